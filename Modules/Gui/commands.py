@@ -6,7 +6,7 @@ from PyQt5.QtWidgets import QWidget,     \
 from PyQt5.QtGui import QImage
 from PyQt5.QtCore import Qt
 
-from .. import image_tools
+from .. import profiling
 from Modules.Gui.reset_slider import ResetSlider
 from . import stylesheets
 
@@ -21,11 +21,6 @@ class Commands(QWidget):
         self.pic = pic
         self.filters = filters
         self.sliders = []
-        
-        self.effects = {'Color'      : False,
-                        'Brightness' : False,
-                        'Contrast'   : False,
-                        'Sharpness'  : False}
         self.effect_sliders = {}
 
         self.make_effect_slider(effect = 'Contrast',
@@ -96,13 +91,6 @@ class Commands(QWidget):
 
         self.setLayout(meta_grid)
 
-    def set_effects(self):
-        """
-        Reset all effects (e.g., color-balance, contrast)
-        """
-        for k in self.effects.keys():
-            self.effects[k] = False
-
     def adjust_size(self):
         """
         Resize the widget whether is needed.
@@ -126,10 +114,19 @@ class Commands(QWidget):
         Reset only the red, green and blue sliders to
         their default value.
         """
-        self.filters.reset()
         for slider in self.rgb_sliders.values():
             slider.reset()
 
+    def group_drags(self, slider):
+        """
+        Record the changes made while 'slider' is dragged as a
+        single step of the history.
+        """
+        slider.sliderPressed.connect(self.pic.history.start_group)
+        # Connected after the slider's own handler, which records
+        # the value it is released at.
+        slider.sliderReleased.connect(self.pic.history.end_group)
+
     def make_RGB_sliders(self):
         """
         Initialize the red, green and blue sliders.
@@ -138,9 +135,13 @@ class Commands(QWidget):
         for color, html_color in zip(('red', 'green', 'blue'), 
                                      ('#ff0000', '#5dff00', '#0008ff')):
             self.rgb_sliders[color] = ResetSlider(0, -255, 255)
-            self.rgb_sliders[color].valueChanged.connect(
+            self.rgb_sliders[color].dragged.connect(
+                partial(self.change_RGB, color, self.rgb_sliders[color], True)
+            )
+            self.rgb_sliders[color].settled.connect(
                 partial(self.change_RGB, color, self.rgb_sliders[color])
             )
+            self.group_drags(self.rgb_sliders[color])
             self.rgb_sliders[color].setStyleSheet(
                 stylesheets.slider_stylesheet(handle_color = '#FFFFFF', 
                                               groove_color_start = '#000000', 
@@ -160,9 +161,13 @@ class Commands(QWidget):
         Initialize the effects sliders (e.g., color-balance, contrast).
         """
         slider = ResetSlider(default, minv, maxv, scale_factor = scale_factor)
-        slider.valueChanged.connect(
+        slider.dragged.connect(
+            partial(self.change_effect, slider, effect, True)
+        )
+        slider.settled.connect(
             partial(self.change_effect, slider, effect)
         )
+        self.group_drags(slider)
         slider.setStyleSheet(
             stylesheets.slider_stylesheet(handle_color = handle_color, 
                                           groove_color_stop = groove_color_stop)
@@ -176,36 +181,25 @@ class Commands(QWidget):
         self.sliders.append(slider)
         self.effect_sliders[effect] = slider
 
-    def change_RGB(self, color, rgb_slider):
+    def change_RGB(self, color, rgb_slider, draft = False):
         """
         Change a color band by an amount equal to the value
-        of the corresponding slider.
-        """
-        if self.pic.image:
-            self.filters.reset()
-            for slider in self.effect_sliders.values():
-                slider.reset()
-            self.set_effects()
-            self.pic.to_display = image_tools.change_RGB_color(
-                                    self.pic,
-                                    color, 
-                                    rgb_slider)
-            self.pic.cache_colors = image_tools.get_modes(self.pic.to_display)
-            self.pic.update()
-
-    def change_effect(self, slider, effect):
+        of the corresponding slider. While the slider is dragged
+        ('draft') a quicker, reduced quality preview is rendered.
+        """
+        if self.pic.opened():
+            with profiling.span('Commands.change_RGB'):
+                self.pic.edit(color, rgb_slider.value(), draft)
+
+    def change_effect(self, slider, effect, draft = False):
         """
         Change an effect, by an amount equal to the
-        corresponding slider value.
+        corresponding slider value. While the slider is dragged
+        ('draft') a quicker, reduced quality preview is rendered.
         """
-        if self.pic.image:
-            self.filters.reset()
-            self.pic.to_display = image_tools.change_effect(
-                                      self.pic, 
-                                      slider, 
-                                      effect, 
-                                      self.effects)
-            self.pic.update()
+        if self.pic.opened():
+            with profiling.span('Commands.change_effect'):
+                self.pic.edit(effect, slider.value(), draft)
 
     def delete(self):
         """
@@ -220,6 +214,17 @@ class Commands(QWidget):
         """
         Restore the originally loaded image.
         """
-        self.reset_sliders()
-        self.filters.reset(reset_tranparency = True)
-        self.pic.restore()
+        with self.pic.history.group():
+            self.reset_sliders()
+            self.filters.reset(reset_tranparency = True)
+            self.pic.restore()
+
+    def show_edits(self, edits):
+        """
+        Move the sliders to the values in 'edits' without
+        changing the image.
+        """
+        for color, slider in self.rgb_sliders.items():
+            slider.show_value(edits[color])
+        for effect, slider in self.effect_sliders.items():
+            slider.show_value(edits[effect])
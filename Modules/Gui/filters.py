@@ -1,23 +1,86 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+import os
+import traceback
 
-from PyQt5.QtWidgets import QWidget,   \
-                            QCheckBox, \
+from PyQt5.QtWidgets import QWidget,     \
+                            QCheckBox,   \
+                            QLabel,      \
+                            QGridLayout, \
                             QVBoxLayout
-from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtCore import Qt,         \
+                         QTimer,     \
+                         pyqtSignal
 
 from .. import image_tools
+from .. import edits
+from .. import profiling
 from . import stylesheets
+from .picture import Picture
+
+# Size the thumbnails of the filters fit in.
+THUMBNAIL_SIZE = 80
+
+def report_error(future):
+    """
+    Print the traceback of the exception raised by the job of
+    'future', if any: nobody waits for the result of a thumbnail.
+    """
+    if not future.cancelled() and future.exception() is not None:
+        error = future.exception()
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+class Thumbnail(QLabel):
+    """
+    Subclass of QLabel. Shows how the image looks with a filter,
+    and chooses the filter when clicked.
+    """
+    clicked = pyqtSignal()
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.setFixedSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self.setAlignment(Qt.AlignCenter)
+        self.setStyleSheet(stylesheets.label())
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.clicked.emit()
 
 class Filters(QWidget):
     """
     Subclass of QWidget. Contains pre-defined filters available im pillow.
-    Only one filter at a time can be applied, except for the transparency
-    filter which can be always applied.
+    Several filters can be applied: they are applied in the order
+    they were checked. The transparency filter can be always applied.
+    Every filter has a thumbnail showing the image with the current
+    edits and that filter. The thumbnails are rendered in parallel on
+    a reduced copy of the preview, when the image or the edits change
+    and the tab is visible; renders of a previous state are cancelled.
     """
+    # Filter name, rendered thumbnail (QImage and its pixels), generation.
+    thumbnail_ready = pyqtSignal(str, object, int)
+
     def __init__(self, parent):
         super().__init__(parent)
         self.pic = parent.pic
+        # Reduced copy of the preview the thumbnails are rendered from.
+        self.pipeline = None
+        # Edits the thumbnails show (without the filter).
+        self.shown = None
+        self.generation = 0
+        self.futures = []
+        self.pool = ThreadPoolExecutor(
+            max_workers = min(len(image_tools.FILTERS), os.cpu_count() or 1))
+        self.thumbnail_ready.connect(self.show_thumbnail)
+        self.pic.preview_changed.connect(self.set_preview)
+        self.pic.edits_changed.connect(self.queue_thumbnails)
+        # Render the thumbnails once a slider stops moving.
+        self.thumbnails_timer = QTimer(self)
+        self.thumbnails_timer.setSingleShot(True)
+        self.thumbnails_timer.setInterval(150)
+        self.thumbnails_timer.timeout.connect(self.render_thumbnails)
 
         self.filters = OrderedDict()
         self.filters['BLUR'] = QCheckBox('Blur', self)
@@ -27,7 +90,7 @@ class Filters(QWidget):
         self.filters['EDGE_ENHANCE_MORE'] = QCheckBox('More edge enhance', self)
         self.filters['EMBOSS'] = QCheckBox('Emboss', self)
         # This filter does not work properly with RGBA formats.
-        # A workaround is used in self.apply.
+        # A workaround is used in image_tools.apply_filter.
         self.filters['FIND_EDGES'] = QCheckBox('Find edges', self)
         self.filters['SHARPEN'] = QCheckBox('Sharpen', self)
         self.filters['SMOOTH'] = QCheckBox('Smooth', self)
@@ -35,12 +98,20 @@ class Filters(QWidget):
 
         self.transparency = QCheckBox('Transparency', self)
 
-        vbox = QVBoxLayout()
-        for filter_name, check_filter in self.filters.items():
+        self.thumbnails = {}
+        grid = QGridLayout()
+        for i, (filter_name, check_filter) in enumerate(self.filters.items()):
             check_filter.setStyleSheet(stylesheets.check_box())
             check_filter.stateChanged.connect(partial(self.apply, filter_name))
-            vbox.addWidget(check_filter)
+            thumbnail = Thumbnail(self)
+            thumbnail.clicked.connect(check_filter.toggle)
+            self.thumbnails[filter_name] = thumbnail
+            row, column = 2 * (i // 2), i % 2
+            grid.addWidget(thumbnail, row, column, Qt.AlignHCenter)
+            grid.addWidget(check_filter, row + 1, column, Qt.AlignHCenter)
 
+        vbox = QVBoxLayout()
+        vbox.addLayout(grid)
         self.transparency.setStyleSheet(stylesheets.check_box())
         self.transparency.stateChanged.connect(self.make_pic_transparent)
         vbox.addWidget(self.transparency)
@@ -49,38 +120,113 @@ class Filters(QWidget):
 
     def apply(self, name, state):
         """
-        Apply the chosen filter. Set all other filters (except for the transparency)
-        to unchecked state (False).
-        If the filter is uncheck, restore the image before the filter application.
+        Add the chosen filter after the ones already applied.
+        If the filter is unchecked, remove it.
         """
-        if self.pic.image:
+        if not self.pic.opened():
+            return
+        with profiling.span('Filters.apply'):
+            names = tuple(n for n in self.pic.edits['filter'] if n != name)
             if state == Qt.Checked:
-                [f.setChecked(False) for n, f in self.filters.items() if n != name]
-                self.pic.before_filter = self.pic.to_display
-                alpha = self.pic.to_display.getchannel("A")
-                self.pic.to_display = image_tools.apply_filter(self.pic, name)
-                self.pic.to_display.putalpha(alpha)
-            else:
-                if not self.pic.white_pixels:
-                    self.pic.to_display = self.pic.before_filter
-                else:
-                    alpha = self.pic.to_display.getchannel("A")
-                    self.pic.to_display = self.pic.before_filter
-                    self.pic.to_display.putalpha(alpha)
-            self.pic.update()
+                names += (name,)
+            self.pic.edit('filter', names)
+
+    def set_preview(self, preview, generation):
+        """
+        Render the thumbnails from a new preview, or remove them
+        if 'preview' is None.
+        """
+        self.cancel_thumbnails()
+        self.shown = None
+        if preview is None:
+            self.pipeline = None
+            for thumbnail in self.thumbnails.values():
+                thumbnail.clear()
+            return
+        self.pipeline = edits.Pipeline(
+            image_tools.make_proxy(preview, (THUMBNAIL_SIZE, THUMBNAIL_SIZE)))
+        self.render_thumbnails()
+
+    def queue_thumbnails(self):
+        """
+        Render the thumbnails with the new edits, once they stop
+        changing.
+        """
+        self.thumbnails_timer.start()
+
+    def cancel_thumbnails(self):
+        """
+        Cancel the renders not started yet and ignore the others.
+        """
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+
+    def render_thumbnails(self):
+        """
+        Render the thumbnail of every filter in parallel, unless
+        they already show the current edits or the tab is hidden.
+        """
+        if self.pipeline is None or not self.isVisible():
+            return
+        edits_ = self.pic.edits.copy()
+        edits_['filter'] = ()
+        if self.shown is not None and self.shown.key() == edits_.key():
+            return
+        self.cancel_thumbnails()
+        self.shown = edits_
+        for name in self.filters:
+            thumbnail_edits = edits_.copy()
+            thumbnail_edits['filter'] = (name,)
+            future = self.pool.submit(self.render_thumbnail, self.pipeline,
+                                      name, thumbnail_edits, self.generation)
+            future.add_done_callback(report_error)
+            self.futures.append(future)
+
+    def render_thumbnail(self, pipeline, name, edits_, generation):
+        """
+        Render the thumbnail of the filter 'name'. Runs on the pool.
+        """
+        if generation != self.generation:
+            return
+        with profiling.span('Filters.render_thumbnail'):
+            image = pipeline.render(edits_)
+            self.thumbnail_ready.emit(name, Picture.qt_tweaks(image),
+                                      generation)
+
+    def show_thumbnail(self, name, thumbnail, generation):
+        """
+        Display a rendered thumbnail, unless it is stale.
+        """
+        if generation == self.generation:
+            qim, _ = thumbnail
+            self.thumbnails[name].setPixmap(QPixmap.fromImage(qim))
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.render_thumbnails()
 
     def make_pic_transparent(self, state):
         """
         Make all white pixels transparent.
         If unchecked, restore white pixels.
         """
-        if self.pic.image:
-            if state == Qt.Checked:
-                image_tools.make_transparent(self.pic)
-            else:
-                image_tools.reset_alpha(self.pic)
-            self.pic.cache_colors = image_tools.get_modes(self.pic.to_display)
-            self.pic.update()
+        if self.pic.opened():
+            with profiling.span('Filters.make_pic_transparent'):
+                self.pic.edit('transparency', state == Qt.Checked)
+
+    def show_edits(self, edits):
+        """
+        Check the boxes according to 'edits' without changing
+        the image.
+        """
+        boxes = [(f, n in edits['filter']) for n, f in self.filters.items()]
+        boxes.append((self.transparency, edits['transparency']))
+        for check_box, checked in boxes:
+            check_box.blockSignals(True)
+            check_box.setChecked(checked)
+            check_box.blockSignals(False)
 
     def reset(self, reset_tranparency = False):
         """
@@ -1,21 +1,32 @@
 import os
-from PyQt5.QtWidgets import qApp,        \
-                            QMainWindow, \
-                            QWidget,     \
-                            QGridLayout, \
-                            QAction,     \
-                            QFileDialog, \
-                            QSizePolicy, \
-                            QTabWidget
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from PyQt5.QtWidgets import qApp,         \
+                            QMainWindow,  \
+                            QWidget,      \
+                            QGridLayout,  \
+                            QAction,      \
+                            QActionGroup, \
+                            QFileDialog,  \
+                            QSizePolicy,  \
+                            QTabWidget,   \
+                            QLabel,       \
+                            QProgressBar
 from PyQt5.QtGui import QImage
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
 
+from .. import image_tools
+from .. import profiling
 from . import stylesheets
 from Modules.Gui.commands import Commands
 from Modules.Gui.filters import Filters
 from Modules.Gui.picture import Picture
 
 class MainWindow(QMainWindow):
+    # Name of a saved file, seconds taken and exception, if any.
+    save_done = pyqtSignal(str, float, object)
+
     def __init__(self):
         super().__init__()
         self.initUI()
@@ -26,11 +37,27 @@ class MainWindow(QMainWindow):
         """
         self.save_path = None
         self.open_path = None
+        self.save_preset = image_tools.DEFAULT_PRESET
+        # The images are saved one at a time, in the background.
+        self.saver = ThreadPoolExecutor(max_workers = 1)
+        self.saves_pending = 0
+        self.save_done.connect(self.save_finished)
         wid = QWidget()
         self.setCentralWidget(wid)
         wid.setStyleSheet(stylesheets.main_window())
 
         self.statusBar()
+        self.timings = QLabel()
+        self.timings.hide()
+        self.statusBar().addPermanentWidget(self.timings)
+        self.timings_timer = QTimer(self)
+        self.timings_timer.setInterval(500)
+        self.timings_timer.timeout.connect(self.show_timings)
+        self.save_progress = QProgressBar()
+        self.save_progress.setRange(0, 0)
+        self.save_progress.setMaximumWidth(120)
+        self.save_progress.hide()
+        self.statusBar().addPermanentWidget(self.save_progress)
 
         menubar = self.menuBar()
         fileMenu = menubar.addMenu('&File')
@@ -39,6 +66,17 @@ class MainWindow(QMainWindow):
         self.new_action(fileMenu, 'Save as..', 'Ctrl+Shift+S', 'Save file as..', 
             self.show_save_dialog)
         self.new_action(fileMenu, 'Save', 'Ctrl+S', 'Save file', self.save_current)
+        presetMenu = fileMenu.addMenu('Save options')
+        presets = QActionGroup(self)
+        tips = {'Fast'     : 'Save quickly, with bigger files',
+                'Balanced' : 'Balance file size and save time',
+                'Small'    : 'Save the smallest files, slowly'}
+        for preset in image_tools.PRESETS:
+            action = self.new_action(presetMenu, preset, None, tips[preset],
+                                     partial(self.set_save_preset, preset),
+                                     checkable = True)
+            action.setChecked(preset == self.save_preset)
+            presets.addAction(action)
         self.new_action(fileMenu, 'Exit', None, 'Exit application', qApp.quit)
 
         self.pic = Picture(self)
@@ -50,17 +88,60 @@ class MainWindow(QMainWindow):
         self.commands = Commands(self, self.pic, self.filters)
 
         imageMenu = menubar.addMenu('&Image')
+        self.new_action(imageMenu, 
+                       'Undo', 
+                       'Ctrl+Z', 
+                       'Undo the last change', 
+                       self.undo)
+        self.new_action(imageMenu, 
+                       'Redo', 
+                       'Ctrl+Shift+Z', 
+                       'Redo the last undone change', 
+                       self.redo)
         self.new_action(imageMenu, 
                        'Reset image', 
                        'Ctrl+R', 
                        'Reset image', 
                        self.commands.total_reset)
+        self.new_action(imageMenu, 
+                       'Apply edits', 
+                       'Ctrl+Shift+A', 
+                       'Apply the edits to the full resolution image', 
+                       self.apply_edits)
         self.new_action(imageMenu, 
                        'Clear', 
                        'Ctrl+C', 
                        'Remove image', 
                        self.commands.delete)
 
+        viewMenu = menubar.addMenu('&View')
+        self.new_action(viewMenu, 
+                       'Zoom in', 
+                       'Ctrl++', 
+                       'Zoom in (or use the mouse wheel)', 
+                       self.pic.zoom_in)
+        self.new_action(viewMenu, 
+                       'Zoom out', 
+                       'Ctrl+-', 
+                       'Zoom out (or use the mouse wheel)', 
+                       self.pic.zoom_out)
+        self.new_action(viewMenu, 
+                       'Fit to window', 
+                       'Ctrl+0', 
+                       'Show the whole image (or double click on it)', 
+                       self.pic.fit)
+        self.new_action(viewMenu, 
+                       'Timings', 
+                       'Ctrl+T', 
+                       'Show how long each step of an update takes', 
+                       self.toggle_timings,
+                       checkable = True)
+        self.new_action(viewMenu, 
+                       'Export timings..', 
+                       None, 
+                       'Save the timings as a Chrome trace', 
+                       self.export_timings)
+
         self.commands_panel = QTabWidget()
         policy = QSizePolicy(QSizePolicy.Minimum, QSizePolicy.Preferred)
         self.commands_panel.setSizePolicy(policy)
@@ -72,22 +153,27 @@ class MainWindow(QMainWindow):
         grid.addWidget(self.commands_panel, 0, 0)
         grid.setSpacing(10)
         grid.addWidget(self.pic, 0, 1)
+        # The picture takes all the space left by the commands.
+        grid.setColumnStretch(1, 1)
 
         wid.setLayout(grid)
         self.setGeometry(100, 100, 1280, 720)
         self.setWindowTitle('Pycture')
         self.show()
 
-    def new_action(self, menu, name, shortcut, statustip, connection):
+    def new_action(self, menu, name, shortcut, statustip, connection,
+                   checkable = False):
         """
         Add a QAction to the menu.
         """
         action = QAction(name, self)
+        action.setCheckable(checkable)
         if shortcut:
             action.setShortcut(shortcut)
         action.setStatusTip(statustip)
         action.triggered.connect(connection)
         menu.addAction(action)
+        return action
 
     def show_open_dialog(self):
         if self.open_path and os.path.isdir(self.open_path):
@@ -101,10 +187,10 @@ class MainWindow(QMainWindow):
             self.open_path = os.path.dirname(fname[0])
             self.pic.path = fname[0]
             self.pic.extension = fname[0][-3:].lower()
-            self.pic.prep_image()
-            self.pic.name = None
             self.commands.reset_sliders()
             self.filters.reset(reset_tranparency = True)
+            self.pic.prep_image()
+            self.pic.name = None
 
     def save_current(self):
         """
@@ -112,10 +198,7 @@ class MainWindow(QMainWindow):
         don't ask for a new name.
         """
         if self.pic.name:
-            if self.pic.name[-3:] == 'jpg' or self.pic.name[-3:] == 'tif':
-                self.pic.to_display.convert('RGB').save(self.pic.name)
-            else:
-                self.pic.to_display.save(self.pic.name)
+            self.save(self.pic.name)
         else:
             self.show_save_dialog()
 
@@ -136,11 +219,101 @@ class MainWindow(QMainWindow):
                 # fname[0] in Windows contains the extension, but not in Linux.
                 # This line fixes the problem.
                 self.pic.name = fname[0].split('.')[0] + fname[1][1:]
-                ext = self.pic.name[-3:]
-                if ext == 'jpg' or ext == 'tif':
-                    self.pic.to_display.convert('RGB').save(self.pic.name)
-                else:
-                    self.pic.to_display.save(self.pic.name)
+                self.save(self.pic.name)
+
+    def set_save_preset(self, preset, checked = True):
+        self.save_preset = preset
+
+    def save(self, name):
+        """
+        Save the full resolution image with the current edits as
+        'name' in the background. The image and the edits are taken
+        now, so the editing can go on during the save.
+        """
+        render = self.pic.snapshot()
+        self.saves_pending += 1
+        self.save_progress.show()
+        self.statusBar().showMessage(f'Saving {name}..')
+        future = self.saver.submit(self.write_image, render, name,
+                                   self.save_preset)
+        future.add_done_callback(partial(self.save_written, name))
+
+    @staticmethod
+    def write_image(render, name, preset):
+        """
+        Render and save an image. Runs on the save worker.
+        Return the seconds taken.
+        """
+        start = time.perf_counter()
+        image_tools.save_image(render(), name, preset)
+        return time.perf_counter() - start
+
+    def save_written(self, name, future):
+        """
+        Send the outcome of a save to the GUI thread.
+        """
+        error = future.exception()
+        self.save_done.emit(name, 0.0 if error else future.result(), error)
+
+    def save_finished(self, name, seconds, error):
+        self.saves_pending -= 1
+        if not self.saves_pending:
+            self.save_progress.hide()
+        if error is None:
+            self.statusBar().showMessage(f'Saved {name} in {seconds:.2f}s', 5000)
+        else:
+            self.statusBar().showMessage(f'Could not save {name}: {error}')
+
+    def apply_edits(self):
+        """
+        Render the edits on the full resolution image and use the
+        result as the new starting point.
+        """
+        if self.pic.image:
+            self.pic.apply_edits()
+            self.show_edits()
+
+    def undo(self):
+        if self.pic.image and self.pic.undo():
+            self.show_edits()
+
+    def redo(self):
+        if self.pic.image and self.pic.redo():
+            self.show_edits()
+
+    def show_edits(self):
+        """
+        Update sliders and filters to the current edits.
+        """
+        self.commands.show_edits(self.pic.edits)
+        self.filters.show_edits(self.pic.edits)
+
+    def toggle_timings(self, checked):
+        """
+        Start or stop timing the updates, showing the results in
+        the status bar.
+        """
+        profiling.enable(checked)
+        self.timings.setVisible(checked)
+        if checked:
+            profiling.clear()
+            self.timings_timer.start()
+            self.show_timings()
+        else:
+            self.timings_timer.stop()
+
+    def show_timings(self):
+        self.timings.setText(profiling.summary())
+
+    def export_timings(self):
+        """
+        Save the recorded timings as a Chrome trace. Ask for a name.
+        """
+        fname = QFileDialog.getSaveFileName(self, 'Export timings',
+            self.default_directory(), '*.json')
+        if fname[0]:
+            name = fname[0] if fname[0].endswith('.json') else fname[0] + '.json'
+            profiling.export_chrome_trace(name)
 
     @staticmethod
     def default_directory():
@@ -1,84 +1,753 @@
-from PyQt5.QtWidgets import QLabel
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, \
+                      partial
+import threading
+import traceback
+
+from PyQt5.QtWidgets import QLabel, \
+                            QStyle
 from PyQt5.QtGui import QImage,       \
                         QImageReader, \
+                        QPainter,     \
                         QPixmap
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt,     \
+                         QPoint, \
+                         QRect,  \
+                         QTimer, \
+                         pyqtSignal
 
 from .. import image_tools
+from .. import decode_cache
+from .. import edits
+from .. import history
+from .. import profiling
+from ..scheduler import RenderScheduler
+from ..render_cache import RenderCache
 from . import stylesheets
+from .pyramid import Pyramid, \
+                     scaled
+
+# Longest wait of the full decode for the reduced one, in seconds.
+DRAFT_TIMEOUT = 1.0
+# Largest zoom, in screen pixels per image pixel.
+MAX_PIXEL_SCALE = 8
+ZOOM_STEP = 1.25
+# Scale of the previews rendered while a slider is dragged.
+DRAFT_SCALE = 0.5
+# Size of the tiles compared to find the changes of the preview.
+DISPLAY_TILE = 128
+
+@lru_cache(maxsize = None)
+def image_formats():
+    """
+    Formats Qt can read, probed once.
+    """
+    return QImageReader.supportedImageFormats()
+
+def paint_tiles(device, tiles):
+    """
+    Paint the tiles (x, y, QImage, pixels) on 'device', replacing
+    its pixels.
+    """
+    if tiles:
+        painter = QPainter(device)
+        painter.setCompositionMode(QPainter.CompositionMode_Source)
+        for x, y, tile, _ in tiles:
+            painter.drawImage(x, y, tile)
+        painter.end()
 
 class Picture(QLabel):
     """
     Subclass of QLabel. It contains the image displayed on screen.
+    All the edits are performed on a preview of the image, reduced
+    to the size of the label. The full resolution image is rendered
+    only when it is saved or when the edits are applied.
+    The preview is owned by a background scheduler: the renders are
+    queued there and the finished frames are sent back with the
+    'frame_ready' signal.
+    When an image is opened, a reduced decode is displayed first
+    while the full resolution image is decoded by the loader; the
+    decoded image is sent back with the 'source_ready' signal.
+    When zoomed in, the visible region of the full resolution image
+    (the view) is rendered at the size of the label as well, and a
+    region of the preview is displayed until the view is ready.
+    Only the tiles of the preview that changed since the previous
+    frame are converted, sent and repainted.
+    While a slider is dragged, the frames are rendered at a reduced
+    resolution; the full preview is rendered once it is released.
     """
+    # Preview (size and changed tiles), new view (QImage, its pixels
+    # and its box in the full resolution image) or None, generation.
+    frame_ready = pyqtSignal(object, object, int)
+    source_ready = pyqtSignal(object, int)
+    # Decoded full resolution image and its copy mapped from the
+    # decode cache.
+    source_mapped = pyqtSignal(object, object)
+    # Future of a change of the full resolution image (e.g., the
+    # edits applied) made on the loader thread.
+    source_changed = pyqtSignal(object)
+    # New preview (None when the image is removed) and its generation.
+    preview_changed = pyqtSignal(object, int)
+    edits_changed = pyqtSignal()
+
     def __init__(self, parent):
         super().__init__('', parent)
         self.image = None
         self.name = None
         self.path = None
         self.extension = None
-        self.to_display = None
-        self.original = None
-        self.original_alpha = None
-        self.cache_colors = None
-        self.white_pixels = None
+        self.source = None
+        # Size of the image being opened, known before it is decoded.
+        self.source_size = None
+        # Future of the full resolution decode.
+        self.loading = None
+        self.loader = ThreadPoolExecutor(max_workers = 1)
+        # Future of the last change of the full resolution image
+        # queued on the loader, or None.
+        self.source_job = None
+        self.pipeline = None
+        self.edits = edits.Edits()
+        self.history = history.History()
+        # Previews already rendered, e.g., previous positions of a slider.
+        self.render_cache = RenderCache()
         self.qim = None
+        # Reduced copies of self.qim, used to scale it.
+        self.pyramid = None
+        self.view_qim = None
+        self.view_data = None
+        self.view_qim_box = None
+        # Zoom (1 shows the whole image) and center of the view,
+        # relative to the size of the image.
+        self.zoom = 1.0
+        self.center = (0.5, 0.5)
+        self.drag = None
+        # Incremented every time the source changes, so that frames
+        # of a previous image are never displayed.
+        self.generation = 0
+        self.pipeline_generation = 0
+        self.frame = None
+        # Key and pipeline of the view, and its last render.
+        self.view = None
+        self.view_frame = None
+        # Last frames sent to the GUI thread, and the hashes of the
+        # tiles of the preview, valid for 'hashes_key'.
+        self.published = None
+        self.published_view = None
+        self.tile_hashes = {}
+        self.hashes_key = None
+
+        self.frame_ready.connect(self.show_frame)
+        self.source_ready.connect(self.source_loaded)
+        self.source_mapped.connect(self.replace_source)
+        self.source_changed.connect(self.source_job_done)
+        self.scheduler = RenderScheduler(on_idle = self.publish)
+
+        # Rebuild the preview only once the user stops resizing.
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(200)
+        self.preview_timer.timeout.connect(self.rebuild_preview)
 
         self.setMinimumSize(150, 150) # Minimum size of the displayed picture.
         self.setStyleSheet(stylesheets.label())
 
     def display_properties(self):
         """
-        Display the image properties on the status tip when the mouse
-        is over the image.
+        Display the image properties and the memory used on the
+        status tip when the mouse is over the image.
         """
-        w, h = self.original.size
-        self.setStatusTip(f'{w}x{h} pixels image ({self.extension})')
+        w, h = self.source_size
+        if self.source is None:
+            loading = ', loading'
+        elif self.source_job is not None:
+            loading = ', updating'
+        else:
+            loading = ''
+        tip = f'{w}x{h} pixels image ({self.extension}{loading})'
+        memory = profiling.memory()
+        if memory is not None:
+            resident, mapped = memory
+            tip += (f' - {resident / 2 ** 20:.0f} MB resident'
+                    f' ({mapped / 2 ** 20:.0f} MB file-backed)')
+        self.setStatusTip(tip)
+
+    def opened(self):
+        """
+        Whether an image is open, even if it is not displayed yet
+        (e.g., the first frame is still being decoded): its edits
+        are recorded and rendered once it is.
+        """
+        return self.path is not None
 
     def prep_image(self):
         """
-        Prepare the image to be displayed on screen.
+        Prepare the image to be displayed on screen. A reduced
+        decode is displayed as soon as possible, the full
+        resolution image replaces it once it is decoded.
+        """
+        image_formats()
+        # The first image opened loads Pillow, here rather than on
+        # the background threads below.
+        image_tools.register_formats()
+        self.edits.reset()
+        self.history.clear()
+        self.source = None
+        self.source_job = None
+        self.zoom = 1.0
+        self.center = (0.5, 0.5)
+        self.generation += 1
+        generation = self.generation
+        self.render_cache.clear()
+        self.scheduler.cancel()
+        drafted = threading.Event()
+        self.scheduler.submit(self.load_draft, self.path, self.preview_size(),
+                              generation, drafted)
+        self.loading = self.loader.submit(self.decode_source, self.path,
+                                          drafted)
+        self.loading.add_done_callback(
+            lambda future: self.source_ready.emit(future, generation))
+
+    def load_draft(self, path, size, generation, drafted):
+        """
+        Display a reduced decode of the image at 'path', if the
+        format allows it. Runs on the scheduler thread.
+        """
+        try:
+            draft, self.source_size = image_tools.open_preview(path, size)
+            if draft is not None:
+                self.load_preview(draft, size, edits.Edits(), generation)
+        finally:
+            drafted.set()
+
+    def decode_source(self, path, drafted):
+        """
+        Decode the full resolution image. Runs on the loader thread,
+        after the reduced decode so that the two do not compete.
+        Images decoded before are mapped from the decode cache.
+        """
+        try:
+            # The key of the file as it is decoded.
+            entry = decode_cache.entry_path(path)
+        except OSError:
+            entry = None
+        image = decode_cache.load(path, entry)
+        if image is not None:
+            return image
+        drafted.wait(DRAFT_TIMEOUT)
+        image = image_tools.prepare_image(path, self)
+        if entry is not None:
+            # Stored once the image has been handed to the GUI.
+            self.loader.submit(self.map_source, path, image, entry)
+        return image
+
+    def map_source(self, path, image, entry):
+        """
+        Store the decoded 'image' in the decode cache, as 'entry',
+        and replace it with the copy mapped from the cache, so that
+        the pixels are held once, by pages of the cache file that
+        the system can drop and read again. Runs on the loader thread.
+        """
+        decode_cache.store(path, image, entry)
+        mapped = decode_cache.load(path, entry)
+        if mapped is not None:
+            self.source_mapped.emit(image, mapped)
+
+    def replace_source(self, image, mapped):
+        """
+        Use the mapped copy of the full resolution image, if 'image'
+        is still in use. The pixels are the same, so nothing needs
+        to be rendered again.
+        """
+        if self.source is image:
+            self.source = mapped
+            # The future of the decode holds the decoded image too.
+            self.loading = None
+            self.display_properties()
+
+    def source_loaded(self, future, generation):
+        """
+        Use the decoded full resolution image, unless another
+        image has been opened in the meantime.
         """
-        QImageReader.supportedImageFormats()
-        self.original = image_tools.prepare_image(self.path, self)
+        if generation == self.generation and self.source is None:
+            self.change_source(future.result())
+
+    def next_source(self):
+        """
+        Return a function returning the full resolution image once
+        it is decoded and the changes queued on the loader are done.
+        It can be called on any thread.
+        """
+        if self.source_job is not None:
+            return self.source_job.result
+        if self.source is None:
+            return self.loading.result
+        source = self.source
+        return lambda: source
+
+    def queue_source(self, function, *args):
+        """
+        Run 'function(image, *args)' on the loader thread, 'image'
+        being the full resolution image after the changes queued
+        before, and use its result as the full resolution image.
+        """
+        source = self.next_source()
+        self.source_job = self.loader.submit(
+            lambda: function(source(), *args))
+        self.source_job.add_done_callback(self.source_changed.emit)
         self.display_properties()
-        self.to_display = self.original.copy()
-        self.before_filter = self.original.copy()
-        self.cache_colors = image_tools.get_modes(self.original)
-        self.original_alpha = self.original.getchannel("A").copy()
-        self.qt_tweaks()
-        self.adjust_size()
-        self.set_pixmap()          
 
+    def source_job_done(self, job):
+        """
+        Use the image changed on the loader thread, unless other
+        changes have been queued since or another image has been
+        opened.
+        """
+        if job is not self.source_job:
+            return
+        self.source_job = None
+        error = job.exception()
+        if error is not None:
+            traceback.print_exception(type(error), error, error.__traceback__)
+            self.display_properties()
+            return
+        self.change_source(job.result())
+        # The size of the step applied is known only now.
+        self.history.trim()
+
+    def set_source(self, image):
+        """
+        Use 'image' as the full resolution image and forget all
+        the edits and the history.
+        """
+        self.edits.reset()
+        self.history.clear()
+        self.change_source(image)
+
+    def change_source(self, image):
+        """
+        Use 'image' as the full resolution image, keeping the
+        current edits.
+        """
+        self.source = image
+        self.source_size = image.size
+        self.display_properties()
+        self.generation += 1
+        self.render_cache.clear()
+        self.scheduler.cancel()
+        self.scheduler.submit(self.load_preview, image, self.preview_size(),
+                              self.edits.copy(), self.generation)
+        self.queue_view()
+
+    def preview_size(self):
+        """
+        Size the preview has to fit in.
+        """
+        return self.width(), self.height()
+
+    def load_preview(self, source, size, edits_, generation):
+        """
+        Reduce the full resolution image to 'size' and render 'edits_'
+        on it. Runs on the scheduler thread.
+        """
+        self.pipeline = edits.Pipeline(image_tools.make_proxy(source, size),
+                                       render_cache = self.render_cache,
+                                       source_id = generation)
+        self.pipeline_generation = generation
+        self.preview_changed.emit(self.pipeline.original, generation)
+        self.run_render(edits_)
+
+    def rebuild_preview(self):
+        """
+        Build a bigger preview when the label grows beyond it,
+        and render the view at the new size.
+        """
+        if self.image and self.source is not None:
+            w, h = image_tools.fit_size(self.source.size, self.preview_size())
+            if w > self.qim.width() or h > self.qim.height():
+                self.scheduler.cancel()
+                self.scheduler.submit(self.load_preview, self.source,
+                                      self.preview_size(),
+                                      self.edits.copy(), self.generation)
+            self.queue_view()
+
+    def queue_view(self):
+        """
+        Queue the render of the visible region, if zoomed in.
+        """
+        if self.source is not None:
+            self.scheduler.submit(self.load_view, self.source, self.view_box(),
+                                  self.preview_size(), self.edits.copy(),
+                                  self.generation, key = 'view')
+
+    def load_view(self, source, box, size, edits_, generation):
+        """
+        Reduce the region 'box' of the full resolution image to 'size'
+        and render 'edits_' on it. Runs on the scheduler thread.
+        """
+        if box is None:
+            self.view = None
+            self.view_frame = None
+            self.published_view = None
+            return
+        key = (generation, box, size)
+        if self.view is None or self.view[0] != key:
+            histogram = None
+            if self.pipeline is not None:
+                histogram = self.pipeline.source_histogram()
+            region = image_tools.crop_proxy(source, box, size)
+            self.view = key, edits.Pipeline(region,
+                                            render_cache = self.render_cache,
+                                            source_id = key,
+                                            histogram = histogram)
+        self.view_frame = self.view[1].render(edits_)
+
+    def edit(self, name, value, draft = False):
+        """
+        Change an edit parameter and update the preview, at a
+        reduced resolution if 'draft' (e.g., while a slider is
+        being dragged).
+        """
+        if self.edits[name] != value:
+            self.history.record_edit(name, self.edits[name], value)
+            self.edits[name] = value
+        self.queue_render(draft)
+
+    def queue_render(self, draft = False):
+        """
+        Queue the render of the preview with the current edits.
+        Only the most recent render waiting in the queue is kept.
+        """
+        self.edits_changed.emit()
+        if self.source_job is not None:
+            # Rendered once the full resolution image has changed.
+            return
+        self.scheduler.submit(self.run_render, self.edits.copy(), draft,
+                              key = 'render')
+
+    @profiling.timed('Picture.run_render')
+    def run_render(self, edits_, draft = False):
+        """
+        Render the preview, and the view if zoomed in. Draft renders
+        work on copies reduced by DRAFT_SCALE. Runs on the scheduler
+        thread.
+        """
+        if self.pipeline is not None:
+            pipeline = self.pipeline
+            if draft:
+                pipeline = pipeline.reduced(DRAFT_SCALE)
+            self.frame = pipeline.render(edits_)
+        if self.view is not None:
+            pipeline = self.view[1]
+            if draft:
+                pipeline = pipeline.reduced(DRAFT_SCALE)
+            self.view_frame = pipeline.render(edits_)
+
+    def drop_preview(self):
+        """
+        Release the preview. Runs on the scheduler thread.
+        """
+        self.pipeline = None
+        self.frame = None
+        self.view = None
+        self.view_frame = None
+        self.published = None
+        self.published_view = None
+
+    def publish(self):
+        """
+        Convert the tiles of the preview that changed, and the view
+        if it changed, for Qt and hand them to the GUI thread.
+        Nothing is sent if nothing changed. Runs on the scheduler thread.
+        """
+        if self.frame is None:
+            return
+        tiles = self.changed_tiles(self.frame)
+        view = None
+        if (self.view_frame is not None
+            and self.view_frame is not self.published_view
+            and self.view[0][0] == self.pipeline_generation):
+            view = self.qt_tweaks(self.view_frame) + (self.view[0][1],)
+            self.published_view = self.view_frame
+        if tiles or view is not None:
+            self.frame_ready.emit((self.frame.size, tiles), view,
+                                  self.pipeline_generation)
+
+    @profiling.timed('Picture.changed_tiles')
+    def changed_tiles(self, frame):
+        """
+        Return the tiles of 'frame' that changed since the last
+        frame published, converted for Qt: (x, y, QImage, pixels).
+        The tiles are compared by the hash of their pixels; all of
+        them are returned when the preview is a new one.
+        """
+        if frame is self.published:
+            return []
+        self.published = frame
+        key = (self.pipeline_generation, frame.size)
+        if key != self.hashes_key:
+            self.hashes_key = key
+            self.tile_hashes = {}
+        tiles = []
+        for box, data in image_tools.tiles_data(frame, DISPLAY_TILE):
+            digest = hash(data)
+            if self.tile_hashes.get(box) != digest:
+                self.tile_hashes[box] = digest
+                w, h = box[2] - box[0], box[3] - box[1]
+                tiles.append((box[0], box[1],
+                              QImage(data, w, h, 4 * w, QImage.Format_RGBA8888),
+                              data))
+        return tiles
+
+    def show_frame(self, preview, view, generation):
+        """
+        Display a frame computed by the scheduler, painting only
+        the tiles of the preview that changed.
+        """
+        if generation != self.generation:
+            return
+        (w, h), tiles = preview
+        resized = self.qim is None or (self.qim.width(), self.qim.height()) != (w, h)
+        if resized:
+            self.qim = QImage(w, h, QImage.Format_RGBA8888)
+        # Drop the levels sharing the pixels of self.qim, so that
+        # painting on it does not copy them.
+        self.pyramid = None
+        paint_tiles(self.qim, tiles)
+        self.pyramid = Pyramid(self.qim)
+        if view is not None:
+            self.view_qim, self.view_data, self.view_qim_box = view
+        if resized or view is not None or not self.paint_displayed(tiles):
+            self.update()
+        profiling.frame()
+        # The memory used changes with every frame.
+        self.display_properties()
+
+    def paint_displayed(self, tiles):
+        """
+        Paint 'tiles' on the displayed pixmap and repaint only their
+        area, if the preview is displayed as it is.
+        Return whether it was.
+        """
+        if (not self.image or self.view_box() is not None
+            or self.image.size() != self.qim.size()):
+            return False
+        paint_tiles(self.image, tiles)
+        origin = self.displayed_rect().topLeft()
+        for x, y, tile, _ in tiles:
+            super().update(QRect(origin + QPoint(x, y), tile.size()))
+        return True
+
+    def snapshot(self):
+        """
+        Return a function rendering the full resolution image with
+        the current edits. The later edits do not change its result,
+        so it can be called on another thread.
+        """
+        return partial(self.render, self.next_source(), self.edits.copy())
+
+    @staticmethod
+    def render(source, edits_):
+        """
+        Render 'edits_' on the full resolution image returned by
+        the function 'source'.
+        """
+        return edits.Pipeline(source(), cache_stages = False).render(edits_)
+
+    def apply_edits(self):
+        """
+        Render the edits on the full resolution image, on the loader
+        thread, and use the result as the new starting point. Only
+        the tiles changed by the edits are kept in the history.
+        """
+        step = history.SourceStep(self.edits.values)
+        self.history.push(step)
+        self.queue_source(self.apply_step, step, self.edits.copy())
+        self.edits.reset()
+
+    @staticmethod
+    def apply_step(source, step, edits_):
+        """
+        Render 'edits_' on 'source' and record the change in 'step'.
+        Runs on the loader thread.
+        """
+        image = edits.Pipeline(source, cache_stages = False).render(edits_)
+        step.record(source, image)
+        return image
+
+    def undo(self):
+        """
+        Undo the last change. Return whether there was one.
+        """
+        step = self.history.undo()
+        if step is None:
+            return False
+        if isinstance(step, history.SourceStep):
+            self.edits.values = dict(step.values)
+            self.queue_source(step.undo)
+        else:
+            self.edits.values.update(step.before)
+            self.queue_render()
+        return True
+
+    def redo(self):
+        """
+        Redo the last undone change. Return whether there was one.
+        """
+        step = self.history.redo()
+        if step is None:
+            return False
+        if isinstance(step, history.SourceStep):
+            self.edits.reset()
+            self.queue_source(step.redo)
+        else:
+            self.edits.values.update(step.after)
+            self.queue_render()
+        return True
+
+    @profiling.timed('Picture.adjust_size')
     def adjust_size(self):
         """
         Rescale the displayed image every time it is necessary.
         """
         w = self.width()
         h = self.height()
-        image = QPixmap.fromImage(self.qim)
-        self.image = image.scaled(w, h, Qt.KeepAspectRatio)
+        box = self.view_box()
+        # Scale before building the pixmap, so that only the
+        # displayed pixels are converted and uploaded.
+        if box is None:
+            image = self.pyramid.scaled(w, h)
+        elif box == self.view_qim_box:
+            image = scaled(self.view_qim, w, h)
+        else:
+            image = scaled(self.preview_region(box), w, h)
+        self.image = QPixmap.fromImage(image)
+
+    def view_extent(self):
+        """
+        Size of the visible region of the full resolution image.
+        """
+        sw, sh = self.source.size
+        scale = self.fit_scale() * self.zoom
+        return min(sw, self.width() / scale), min(sh, self.height() / scale)
+
+    def fit_scale(self):
+        """
+        Screen pixels per image pixel when the whole image is shown.
+        """
+        sw, sh = self.source.size
+        return min(self.width() / sw, self.height() / sh)
+
+    def view_box(self):
+        """
+        Visible region of the full resolution image, or None if
+        the whole image is shown.
+        """
+        if self.zoom == 1 or self.source is None:
+            return None
+        sw, sh = self.source.size
+        bw, bh = self.view_extent()
+        x0 = min(max(self.center[0] * sw - bw / 2, 0), sw - bw)
+        y0 = min(max(self.center[1] * sh - bh / 2, 0), sh - bh)
+        return round(x0), round(y0), round(x0 + bw), round(y0 + bh)
 
-    def qt_tweaks(self):
+    def preview_region(self, box):
         """
-        Workaround to display the image in linux as well as in
-        windows.
+        Return the region 'box' of the full resolution image, cut
+        from the preview.
         """
-        # This is the only way to avoid a Windows crash.
-        r, g, b, alpha =  image_tools.get_modes(self.to_display)
-        image = image_tools.merge((b, g, r, alpha))
-        data = image_tools.get_data(image)
-        self.qim = QImage(data, image.size[0], image.size[1],
-            QImage.Format_ARGB32)
+        scale = self.qim.width() / self.source.width
+        x0, y0, x1, y1 = (round(v * scale) for v in box)
+        return self.qim.copy(QRect(x0, y0, max(1, x1 - x0), max(1, y1 - y0)))
 
+    def displayed_rect(self):
+        """
+        Rectangle of the label covered by the displayed image.
+        """
+        return QStyle.alignedRect(self.layoutDirection(), self.alignment(),
+                                  self.image.size(), self.contentsRect())
+
+    def zoom_at(self, pos, factor):
+        """
+        Multiply the zoom by 'factor', keeping the image point
+        under 'pos' (a point of the label) still.
+        """
+        if not self.image or self.source is None:
+            return
+        rect = self.displayed_rect()
+        fx = min(max((pos.x() - rect.x()) / max(rect.width(), 1), 0), 1)
+        fy = min(max((pos.y() - rect.y()) / max(rect.height(), 1), 0), 1)
+        x0, y0, x1, y1 = self.view_box() or (0, 0) + self.source.size
+        px, py = x0 + fx * (x1 - x0), y0 + fy * (y1 - y0)
+        max_zoom = max(1.0, MAX_PIXEL_SCALE / self.fit_scale())
+        self.zoom = min(max(self.zoom * factor, 1.0), max_zoom)
+        bw, bh = self.view_extent()
+        self.set_center(px - fx * bw + bw / 2, py - fy * bh + bh / 2)
+        self.update_view()
+
+    def zoom_in(self):
+        self.zoom_at(self.contentsRect().center(), ZOOM_STEP)
+
+    def zoom_out(self):
+        self.zoom_at(self.contentsRect().center(), 1 / ZOOM_STEP)
+
+    def fit(self):
+        """
+        Show the whole image.
+        """
+        if self.image and self.zoom != 1:
+            self.zoom = 1.0
+            self.center = (0.5, 0.5)
+            self.update_view()
+
+    def set_center(self, x, y):
+        """
+        Center the view on the point 'x', 'y' of the full resolution
+        image, as far as the view stays inside the image.
+        """
+        sw, sh = self.source.size
+        bw, bh = self.view_extent()
+        x = min(max(x, bw / 2), sw - bw / 2)
+        y = min(max(y, bh / 2), sh - bh / 2)
+        self.center = (x / sw, y / sh)
+
+    def update_view(self):
+        """
+        Display the new view at once from the preview and queue
+        its render.
+        """
+        if self.view_box() is None:
+            # The scheduler forgets the view as well.
+            self.view_qim = self.view_data = self.view_qim_box = None
+        self.update()
+        self.queue_view()
+
+    @staticmethod
+    @profiling.timed('Picture.qt_tweaks')
+    def qt_tweaks(to_display):
+        """
+        Convert an RGBA image to a QImage with a single copy of the
+        pixels: the bytes are already in the order expected by
+        Format_RGBA8888, so no band needs to be swapped.
+        The QImage does not own its pixels, so the bytes are returned
+        as well and must be kept alive as long as the QImage.
+        """
+        data = image_tools.get_data(to_display)
+        w, h = to_display.size
+        qim = QImage(data, w, h, 4 * w, QImage.Format_RGBA8888)
+        return qim, data
+
+    @profiling.timed('Picture.set_pixmap')
     def set_pixmap(self):
-        super().setPixmap(self.image)
+        """
+        Repaint the whole displayed image.
+        """
+        super().update()
 
     def update(self):
         """
         Update displayed image.
         """
-        self.qt_tweaks()
         self.adjust_size()
         self.set_pixmap()
 
@@ -86,29 +755,81 @@ class Picture(QLabel):
         """
         Remove the displayed image.
         """
-        if self.image:
-            self.qim = QImage()
-            self.adjust_size()
-            self.set_pixmap()
-            self.to_display = None
-            self.original = None
+        if self.opened():
+            self.generation += 1
+            self.scheduler.cancel()
+            self.qim = None
+            self.pyramid = None
+            self.view_qim = self.view_data = self.view_qim_box = None
+            self.zoom = 1.0
+            self.center = (0.5, 0.5)
             self.image = None
+            self.set_pixmap()
+            self.source = None
+            self.source_size = None
+            self.loading = None
+            self.source_job = None
+            self.history.clear()
+            self.render_cache.clear()
+            self.scheduler.submit(self.drop_preview)
+            self.preview_changed.emit(None, self.generation)
+            self.edits.reset()
             self.name = None
             self.path = None
             self.extension = None
-            self.cache_colors = None
 
     def restore(self):
         """
         Display the original image.
         """
         if self.image:
-            self.to_display = self.original.copy()
-            self.cache_colors = image_tools.get_modes(self.original)
-            self.update()
+            for name, value in edits.DEFAULTS.items():
+                if self.edits[name] != value:
+                    self.history.record_edit(name, self.edits[name], value)
+            self.edits.reset()
+            self.queue_render()
+
+    def paintEvent(self, event):
+        """
+        Draw the border and the displayed image.
+        """
+        with profiling.span('Picture.paintEvent'):
+            super().paintEvent(event)
+            if self.image:
+                painter = QPainter(self)
+                painter.drawPixmap(self.displayed_rect().topLeft(), self.image)
+                painter.end()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.zoom_at(event.pos(), ZOOM_STEP ** steps)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton and self.view_box() is not None:
+            sw, sh = self.source.size
+            self.drag = (event.pos(), self.center[0] * sw, self.center[1] * sh)
+
+    def mouseMoveEvent(self, event):
+        """
+        Pan the view while the image is dragged.
+        """
+        if self.drag is not None and self.view_box() is not None:
+            start, x, y = self.drag
+            scale = self.fit_scale() * self.zoom
+            self.set_center(x - (event.pos().x() - start.x()) / scale,
+                            y - (event.pos().y() - start.y()) / scale)
+            self.update_view()
+
+    def mouseReleaseEvent(self, event):
+        self.drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.fit()
 
     def resizeEvent(self, event):
         super().resizeEvent(event)
         if self.image:
             self.adjust_size()
             self.set_pixmap()
+            self.preview_timer.start()
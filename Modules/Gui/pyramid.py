@@ -0,0 +1,47 @@
+from PyQt5.QtCore import Qt
+
+def scaled(image, w, h):
+    """
+    Scale 'image' to fit in 'w'x'h', smoothly when reducing it and
+    keeping the pixels sharp when enlarging it.
+    """
+    if image.width() >= w or image.height() >= h:
+        mode = Qt.SmoothTransformation
+    else:
+        mode = Qt.FastTransformation
+    return image.scaled(w, h, Qt.KeepAspectRatio, mode)
+
+class Pyramid:
+    """
+    Mip-map pyramid of a QImage: every level is half the size of
+    the previous one. The levels are built only when a size small
+    enough to need them is requested, and every scaling starts from
+    the smallest level still bigger than the target, so its cost
+    depends on the target size only.
+    """
+    def __init__(self, image):
+        self.levels = [image]
+
+    def level(self, w, h):
+        """
+        Return the smallest level that does not need to be enlarged
+        to fit in 'w'x'h'.
+        """
+        image = self.levels[0]
+        i = 0
+        while (image.width() >= 2 * w or image.height() >= 2 * h) \
+              and min(image.width(), image.height()) > 1:
+            i += 1
+            if i == len(self.levels):
+                self.levels.append(image.scaled(image.width() // 2,
+                                                image.height() // 2,
+                                                Qt.IgnoreAspectRatio,
+                                                Qt.SmoothTransformation))
+            image = self.levels[i]
+        return image
+
+    def scaled(self, w, h):
+        """
+        Return the image scaled to fit in 'w'x'h'.
+        """
+        return scaled(self.level(w, h), w, h)
@@ -1,12 +1,24 @@
 from PyQt5.QtWidgets import QSlider
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt,     \
+                         QTimer, \
+                         pyqtSignal
+
+# Most values emitted per second while the handle is dragged.
+DRAG_FPS = 30
 
 class ResetSlider(QSlider):
     """
     Subclass of QSlider. It can be reset to a default value.
     If a scale-factor is given, values from value() functions
     are scaled accordingly.
+    While the handle is dragged, 'dragged' is emitted at most
+    DRAG_FPS times per second, with the values in between dropped;
+    'settled' is emitted when the handle is released and for every
+    other change (e.g., a click on the groove or a reset).
     """
+    dragged = pyqtSignal()
+    settled = pyqtSignal()
+
     def __init__(self, default_value, minv, maxv, 
         scale_factor = None, qalignment = Qt.Vertical):
         super().__init__(qalignment)
@@ -15,6 +27,51 @@ class ResetSlider(QSlider):
         self.setFocusPolicy(Qt.NoFocus)
         self.setRange(minv, maxv)
         self.setValue(self.default_value)
+        # Value last emitted by 'settled', whether 'dragged' has been
+        # emitted since and whether a value is waiting for the timer.
+        self.settled_value = super().value()
+        self.drag_emitted = False
+        self.drag_pending = False
+        self.drag_timer = QTimer(self)
+        self.drag_timer.setInterval(1000 // DRAG_FPS)
+        self.drag_timer.timeout.connect(self.emit_dragged)
+        self.valueChanged.connect(self.value_changed)
+        self.sliderReleased.connect(self.released)
+
+    def value_changed(self):
+        if not self.isSliderDown():
+            self.settle()
+        elif self.drag_timer.isActive():
+            self.drag_pending = True
+        else:
+            self.drag_emitted = True
+            self.dragged.emit()
+            self.drag_timer.start()
+
+    def emit_dragged(self):
+        """
+        Emit the last value dragged to, if any, or stop the timer.
+        """
+        if self.drag_pending:
+            self.drag_pending = False
+            self.dragged.emit()
+        else:
+            self.drag_timer.stop()
+
+    def released(self):
+        self.drag_timer.stop()
+        self.drag_pending = False
+        self.settle()
+
+    def settle(self):
+        """
+        Emit 'settled' if the value changed, or if a value dragged
+        to (but not settled) has been emitted.
+        """
+        if super().value() != self.settled_value or self.drag_emitted:
+            self.settled_value = super().value()
+            self.drag_emitted = False
+            self.settled.emit()
 
     def reset(self):
         """
@@ -22,6 +79,18 @@ class ResetSlider(QSlider):
         """
         self.setValue(self.default_value)
 
+    def show_value(self, value):
+        """
+        Move the slider to 'value' (scaled as the values returned
+        by value()) without emitting valueChanged.
+        """
+        if self.scale_factor:
+            value = round(value * self.scale_factor)
+        self.blockSignals(True)
+        self.setValue(value)
+        self.blockSignals(False)
+        self.settled_value = super().value()
+
     def value(self):
         """
         Returns the current slider value.
@@ -0,0 +1,229 @@
+"""
+Apply the same edits to many images without the GUI.
+Nothing in this module (or in the modules it imports) depends
+on PyQt5.
+
+Usage:
+    python pycture.py batch INPUT [INPUT ...] -o OUTPUT_DIR [options]
+
+INPUT can be a file, a directory or a glob pattern. The edits are
+read from a json recipe (--recipe) whose keys are the names in
+edits.DEFAULTS plus, optionally, 'format'; command line options
+override the recipe.
+TIFF images too big for the memory budget of a worker (--memory)
+are processed in bands and saved as tiled TIFF files.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, \
+                               FIRST_COMPLETED,     \
+                               wait
+
+from . import edits
+from . import image_tools
+from . import tiled
+
+EXTENSIONS = ('png', 'jpg', 'tif')
+
+# Command line options overriding the recipe, with the name
+# of the corresponding edit parameter.
+OPTIONS = {'red'        : 'red',
+           'green'      : 'green',
+           'blue'       : 'blue',
+           'brightness' : 'Brightness',
+           'contrast'   : 'Contrast',
+           'color'      : 'Color',
+           'sharpness'  : 'Sharpness',
+           'filter'     : 'filter'}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog = 'pycture.py batch',
+        description = 'Apply the same edits to many images.')
+    parser.add_argument('inputs', nargs = '+',
+        help = 'files, directories or glob patterns')
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+def add_arguments(parser):
+    """
+    Add the options describing the edits, the output and the workers.
+    """
+    parser.add_argument('-o', '--output', required = True,
+        help = 'directory for the edited images')
+    parser.add_argument('-r', '--recipe',
+        help = 'json file with the edits to apply')
+    parser.add_argument('-f', '--format', choices = EXTENSIONS,
+        help = 'output format (default: same as the input)')
+    parser.add_argument('-p', '--preset', choices = image_tools.PRESETS,
+        default = image_tools.DEFAULT_PRESET,
+        help = 'encoder options, from the fastest to save to the smallest '
+               'file (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type = int, default = os.cpu_count(),
+        help = 'number of worker processes')
+    parser.add_argument('-m', '--memory', type = int,
+        default = tiled.MEMORY_BUDGET // 2 ** 20,
+        help = 'memory budget of each worker in MB: bigger tiff images are '
+               'processed in bands (default: %(default)s)')
+    parser.add_argument('--max-in-flight', type = int, default = None,
+        help = 'maximum number of images being processed or waiting '
+               'for a worker (default: twice the number of jobs)')
+    for option in ('red', 'green', 'blue'):
+        parser.add_argument(f'--{option}', type = int)
+    for option in ('brightness', 'contrast', 'color', 'sharpness'):
+        parser.add_argument(f'--{option}', type = float)
+    parser.add_argument('--filter', choices = image_tools.FILTERS,
+        action = 'append',
+        help = 'filter to apply; can be repeated, the filters are applied '
+               'in the order given')
+    parser.add_argument('--transparency', action = 'store_true',
+        help = 'make white pixels transparent')
+
+def load_recipe(args):
+    """
+    Return the edit parameters and the output format.
+    """
+    recipe = {}
+    if args.recipe:
+        with open(args.recipe) as f:
+            recipe = json.load(f)
+    fmt = recipe.pop('format', None)
+    for option, name in OPTIONS.items():
+        value = getattr(args, option)
+        if value is not None:
+            recipe[name] = value
+    if args.transparency:
+        recipe['transparency'] = True
+    unknown = set(recipe) - set(edits.DEFAULTS)
+    if unknown:
+        raise SystemExit(f'Unknown edits in recipe: {", ".join(sorted(unknown))}')
+    return recipe, args.format or fmt
+
+def find_images(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of images.
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, f) for f in os.listdir(item)]
+        else:
+            candidates = glob.glob(item)
+        paths.update(p for p in candidates
+                     if os.path.isfile(p) and p[-3:].lower() in EXTENSIONS)
+    return sorted(paths)
+
+def output_name(path, output, fmt):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(output, f'{name}.{fmt or path[-3:].lower()}')
+
+def output_names(paths, output, fmt):
+    """
+    Return the output name of each of 'paths'. Raise ValueError if
+    some of them would be written to the same file (e.g., 'a.png'
+    in two directories, or 'a.png' and 'a.jpg' with the same format).
+    """
+    names = {path : output_name(path, output, fmt) for path in paths}
+    sources = {}
+    for path, name in names.items():
+        sources.setdefault(name, []).append(path)
+    clashes = [f'  {name}: {", ".join(inputs)}'
+               for name, inputs in sorted(sources.items()) if len(inputs) > 1]
+    if clashes:
+        raise ValueError('Several images would be saved as the same file:\n'
+                         + '\n'.join(clashes))
+    return names
+
+def process(path, values, name, preset, budget):
+    """
+    Edit a single image. Runs on a worker process.
+    Return the time spent loading, editing and saving the image.
+    """
+    if name[-3:] == 'tif' and tiled.needed(path, budget):
+        # Loaded, edited and saved a band at a time.
+        start = time.perf_counter()
+        tiled.process(path, name, edits.Edits(values), budget, preset)
+        return 0.0, time.perf_counter() - start, 0.0
+    start = time.perf_counter()
+    image = image_tools.prepare_image(path, None)
+    loaded = time.perf_counter()
+    image = edits.Pipeline(image, cache_stages = False).render(
+        edits.Edits(values))
+    edited = time.perf_counter()
+    image_tools.save_image(image, name, preset)
+    saved = time.perf_counter()
+    return loaded - start, edited - loaded, saved - edited
+
+def init_worker():
+    # The files are already spread over all the cores.
+    image_tools.TILED_MIN_PIXELS = float('inf')
+
+def run(paths, values, output, fmt, jobs, max_in_flight,
+        preset = image_tools.DEFAULT_PRESET, budget = tiled.MEMORY_BUDGET,
+        out = sys.stdout):
+    """
+    Process 'paths' on a pool of 'jobs' processes, keeping at
+    most 'max_in_flight' images submitted at the same time, so that
+    the memory used does not depend on the number of files.
+    Return the number of failures. Raise ValueError, before any
+    image is processed, if two images would be saved as the same file.
+    """
+    names = output_names(paths, output, fmt)
+    failures = 0
+    total = {'load' : 0.0, 'edit' : 0.0, 'save' : 0.0}
+    start = time.perf_counter()
+    pending = {}
+    queue = iter(paths)
+    with ProcessPoolExecutor(jobs, initializer = init_worker) as pool:
+        while True:
+            for path in queue:
+                pending[pool.submit(process, path, values, names[path],
+                                     preset, budget)] = path
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    load, edit, save = future.result()
+                except Exception as e:
+                    failures += 1
+                    print(f'FAILED  {path}: {e}', file = out)
+                    continue
+                total['load'] += load
+                total['edit'] += edit
+                total['save'] += save
+                print(f'{load + edit + save:8.3f}s  {path}  '
+                      f'(load {load:.3f}s, edit {edit:.3f}s, save {save:.3f}s)',
+                      file = out)
+    elapsed = time.perf_counter() - start
+    done = len(paths) - failures
+    print(f'{done} images in {elapsed:.3f}s '
+          f'(load {total["load"]:.3f}s, edit {total["edit"]:.3f}s, '
+          f'save {total["save"]:.3f}s of worker time), {failures} failed',
+          file = out)
+    return failures
+
+def main(argv):
+    args = parse_args(argv)
+    values, fmt = load_recipe(args)
+    paths = find_images(args.inputs)
+    if not paths:
+        print('No images found.', file = sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok = True)
+    jobs = max(1, args.jobs or 1)
+    max_in_flight = max(1, args.max_in_flight or 2 * jobs)
+    try:
+        failures = run(paths, values, args.output, fmt, jobs, max_in_flight,
+                       args.preset, args.memory * 2 ** 20)
+    except ValueError as e:
+        print(e, file = sys.stderr)
+        return 1
+    return 1 if failures else 0
@@ -0,0 +1,230 @@
+"""
+This module contains the on-disk cache of the decoded images.
+
+The images opened in the GUI are stored decoded, as raw RGBA pixels
+after a small header, so that reopening one only maps the file in
+memory: the pixels are read from disk when they are first used.
+The entries are keyed by the path, the size and the modification
+time of the file and by a hash of parts of its content, and the
+least recently used ones are removed when the cache grows over
+its size limit.
+Run 'python pycture.py cache info' (or 'clear') to inspect (or empty)
+the cache.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from . import image_tools
+
+# Magic string, width and height of the image.
+HEADER = struct.Struct('<8sII')
+MAGIC = b'PYCRGBA1'
+SUFFIX = '.rgba'
+TEMPORARY_SUFFIX = '.tmp'
+# Default size limit of the cache.
+MAX_BYTES = 4 * 2 ** 30
+# Bytes hashed at the start, in the middle and at the end of a file.
+SAMPLE_BYTES = 2 ** 16
+# Rows of pixels written at a time.
+WRITE_ROWS = 256
+# Seconds after which a temporary file is left over by a write that
+# failed (e.g., the process was killed), not one still being written.
+STALE_SECONDS = 3600
+
+_lock = threading.Lock()
+
+def cache_dir():
+    """
+    Directory of the cache: $PYCTURE_CACHE, or 'pycture' in the
+    user cache directory.
+    """
+    path = os.environ.get('PYCTURE_CACHE')
+    if path:
+        return path
+    base = os.environ.get('XDG_CACHE_HOME') or \
+           os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pycture')
+
+def max_bytes():
+    """
+    Size limit of the cache: $PYCTURE_CACHE_MB megabytes, or MAX_BYTES.
+    """
+    size = os.environ.get('PYCTURE_CACHE_MB')
+    return int(size) * 2 ** 20 if size else MAX_BYTES
+
+def content_hash(path, size):
+    """
+    Hash of the start, the middle and the end of the file at 'path',
+    so that a file rewritten with the same size and time is not
+    mistaken for the cached one, without reading it all.
+    """
+    digest = hashlib.blake2b(digest_size = 16)
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - SAMPLE_BYTES // 2),
+                              max(0, size - SAMPLE_BYTES)}):
+            f.seek(offset)
+            digest.update(f.read(SAMPLE_BYTES))
+    return digest.hexdigest()
+
+def entry_path(path):
+    """
+    Path of the cache entry of the image at 'path'.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = '\0'.join((path, str(stat.st_size), str(stat.st_mtime_ns),
+                     content_hash(path, stat.st_size)))
+    name = hashlib.blake2b(key.encode(), digest_size = 20).hexdigest()
+    return os.path.join(cache_dir(), name + SUFFIX)
+
+def load(path, entry = None):
+    """
+    Return the cached image of the file at 'path', mapped in memory,
+    or None if it is not in the cache. 'entry' is the path of its
+    cache entry, if already known.
+    """
+    try:
+        entry = entry or entry_path(path)
+        with open(entry, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(mapped) < HEADER.size:
+        return None
+    magic, w, h = HEADER.unpack_from(mapped)
+    if magic != MAGIC or len(mapped) != HEADER.size + 4 * w * h:
+        return None
+    try:
+        # The entry is now the most recently used.
+        os.utime(entry)
+    except OSError:
+        # e.g., a cache shared read-only.
+        pass
+    return image_tools.from_buffer('RGBA', (w, h),
+                                   memoryview(mapped)[HEADER.size:])
+
+def store(path, image, entry = None):
+    """
+    Store 'image', the decoded RGBA image of the file at 'path', and
+    remove the least recently used entries if the cache is too big.
+    'entry' is the path of its cache entry, computed before the file
+    was decoded: if the file is replaced during the decode, its key
+    would be stored with the old pixels.
+    """
+    w, h = image.size
+    if HEADER.size + 4 * w * h > max_bytes():
+        return
+    try:
+        entry = entry or entry_path(path)
+        os.makedirs(os.path.dirname(entry), exist_ok = True)
+        temporary = (f'{entry}.{os.getpid()}.{threading.get_ident()}'
+                     f'{TEMPORARY_SUFFIX}')
+    except OSError:
+        return
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, w, h))
+            for data in image_tools.rows_data(image, WRITE_ROWS):
+                f.write(data)
+        os.replace(temporary, entry)
+    except OSError:
+        # e.g., the disk is full.
+        return
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    trim()
+
+def entries():
+    """
+    Return the cache entries as (path, size, last used time),
+    from the least recently used.
+    """
+    found = []
+    try:
+        with os.scandir(cache_dir()) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    stat = entry.stat()
+                    found.append((entry.path, stat.st_size, stat.st_mtime))
+    except FileNotFoundError:
+        pass
+    found.sort(key = lambda entry: entry[2])
+    return found
+
+def remove_temporary(age = STALE_SECONDS):
+    """
+    Remove the temporary files older than 'age' seconds, left over
+    by the writes that did not complete.
+    """
+    now = time.time()
+    try:
+        with os.scandir(cache_dir()) as it:
+            for entry in it:
+                if (entry.name.endswith(TEMPORARY_SUFFIX)
+                    and now - entry.stat().st_mtime >= age):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+    except FileNotFoundError:
+        pass
+
+def trim(limit = None):
+    """
+    Remove the least recently used entries until the cache is
+    not bigger than 'limit' (by default the size limit), and the
+    temporary files left over.
+    """
+    limit = max_bytes() if limit is None else limit
+    with _lock:
+        remove_temporary()
+        found = entries()
+        total = sum(size for _, size, _ in found)
+        for path, size, _ in found:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # e.g., still mapped on Windows.
+                continue
+            total -= size
+
+def clear():
+    """
+    Remove all the entries. Return how many were removed.
+    """
+    count = len(entries())
+    trim(0)
+    remove_temporary(0)
+    return count - len(entries())
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog = 'pycture.py cache',
+        description = 'Inspect or clear the cache of the decoded images.')
+    parser.add_argument('command', choices = ('info', 'clear'))
+    return parser.parse_args(argv)
+
+def main(argv, out = sys.stdout):
+    args = parse_args(argv)
+    if args.command == 'clear':
+        print(f'Removed {clear()} entries from {cache_dir()}', file = out)
+        return 0
+    found = entries()
+    total = sum(size for _, size, _ in found)
+    print(f'Directory: {cache_dir()}', file = out)
+    print(f'Entries:   {len(found)}', file = out)
+    print(f'Size:      {total / 2 ** 20:.1f} MB of '
+          f'{max_bytes() / 2 ** 20:.0f} MB', file = out)
+    if found:
+        oldest = time.strftime('%Y-%m-%d %H:%M', time.localtime(found[0][2]))
+        print(f'Least recently used: {oldest}', file = out)
+    return 0
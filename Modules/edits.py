@@ -0,0 +1,237 @@
+"""
+This module describes the edits applied to a picture.
+The edits are only parameters: they are applied to an image by a
+Pipeline, lazily and always starting from the original image, so
+they can be rendered on a reduced copy of the image (the preview)
+as well as on the full resolution one.
+"""
+
+from . import image_tools
+from . import profiling
+
+# Default value of every edit parameter.
+DEFAULTS = {'red'          : 0,
+            'green'        : 0,
+            'blue'         : 0,
+            'Brightness'   : 1.0,
+            'Contrast'     : 1.0,
+            'Color'        : 1.0,
+            'Sharpness'    : 1.0,
+            'filter'       : (),
+            'transparency' : False}
+
+# The stages of the pipeline, in the order they are applied,
+# with the parameters each of them depends on.
+STAGES = (('tone',         ('red', 'green', 'blue', 'Brightness', 'Contrast')),
+          ('enhance',      ('Color', 'Sharpness')),
+          ('filter',       ('filter',)),
+          ('transparency', ('transparency',)))
+
+def filter_names(value):
+    """
+    Return the filters 'value' (None, the name of a filter or a
+    sequence of names) as a tuple of names.
+    """
+    if not value:
+        return ()
+    if isinstance(value, str):
+        return (value,)
+    return tuple(value)
+
+class Edits:
+    """
+    Parameters of the edits applied to a picture.
+    'filter' is the tuple of the filters applied, in order.
+    """
+    def __init__(self, values = None):
+        self.values = dict(DEFAULTS)
+        if values:
+            self.values.update(values)
+            self.values['filter'] = filter_names(self.values['filter'])
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __setitem__(self, name, value):
+        if name not in DEFAULTS:
+            raise KeyError(name)
+        if name == 'filter':
+            value = filter_names(value)
+        self.values[name] = value
+
+    def copy(self):
+        return Edits(self.values)
+
+    def reset(self):
+        """
+        Set all parameters to their default value.
+        """
+        self.values = dict(DEFAULTS)
+
+    def stages(self):
+        """
+        Return the name and the parameters of each stage.
+        """
+        return [(name, tuple(self.values[p] for p in params))
+                for name, params in STAGES]
+
+    def halo(self):
+        """
+        Pixels around a region of the image that the render of
+        the region depends on.
+        """
+        halo = 0
+        if self.values['Sharpness'] != 1:
+            halo += image_tools.SHARPNESS_HALO
+        for name in self.values['filter']:
+            halo += image_tools.filter_halo(name)
+        return halo
+
+    def key(self):
+        """
+        Return all the parameters as a hashable object.
+        """
+        return tuple(params for _, params in self.stages())
+
+class Pipeline:
+    """
+    Apply edits to an image. The output of every stage is cached
+    with the parameters that produced it, so that changing a
+    late stage (e.g., the filter) does not recompute the early ones.
+    Stages left to their default value do not copy the image.
+    The final images can also be kept in a RenderCache shared
+    by several pipelines: 'source_id' identifies the image the
+    original was obtained from.
+    The contrast depends on the histogram of the whole image: a
+    pipeline working on a region of it is given that 'histogram'.
+    A pipeline rendering once (e.g., the full resolution image)
+    is built with 'cache_stages' False: the output of every stage
+    is then released as soon as the next stage has used it.
+    """
+    def __init__(self, original, render_cache = None, source_id = None,
+                 histogram = None, cache_stages = True):
+        self.original = original
+        self.histogram = histogram
+        self.cache = {}
+        self.cache_stages = cache_stages
+        self.render_cache = render_cache
+        self.source_id = source_id
+        self.reduced_pipeline = None
+        # Last input, degenerate image, amount and result of each
+        # effect of the enhance stage.
+        self.effects = {}
+
+    def render(self, edits):
+        """
+        Return the original image with 'edits' applied.
+        """
+        if self.render_cache is None:
+            return self.render_stages(edits)
+        key = (self.source_id, edits.key(), self.original.size)
+        image = self.render_cache.get(key)
+        if image is None:
+            image = self.render_stages(edits)
+            self.render_cache.put(key, image)
+        return image
+
+    def reduced(self, scale):
+        """
+        Return a pipeline working on a copy of the original reduced
+        by 'scale', for quicker, lower quality renders. It is built
+        once and uses the histogram of the original, so that the
+        contrast does not change.
+        """
+        if self.reduced_pipeline is None or self.reduced_pipeline[0] != scale:
+            w, h = self.original.size
+            size = max(1, round(w * scale)), max(1, round(h * scale))
+            pipeline = Pipeline(image_tools.make_proxy(self.original, size),
+                                render_cache = self.render_cache,
+                                source_id = self.source_id,
+                                histogram = self.source_histogram())
+            self.reduced_pipeline = scale, pipeline
+        return self.reduced_pipeline[1]
+
+    def render_stages(self, edits):
+        """
+        Apply the stages whose output is not cached.
+        """
+        image = self.original
+        chain = ()
+        for name, params in edits.stages():
+            chain += (params,)
+            cached = self.cache.get(name)
+            if cached and cached[0] == chain:
+                image = cached[1]
+            else:
+                with profiling.span(f'Pipeline.{name}'):
+                    image = getattr(self, name)(image, *params)
+                if self.cache_stages:
+                    self.cache[name] = (chain, image)
+        return image
+
+    def source_histogram(self):
+        """
+        Histogram of the original image, computed once.
+        """
+        if self.histogram is None:
+            self.histogram = image_tools.get_histogram(self.original)
+        return self.histogram
+
+    def tone(self, image, red, green, blue, brightness, contrast):
+        """
+        Apply the bands offsets, brightness and contrast with a
+        single lookup table.
+        """
+        if (red, green, blue, brightness, contrast) == (0, 0, 0, 1, 1):
+            return image
+        table = image_tools.tone_table(self.source_histogram(),
+                                       red = red,
+                                       green = green,
+                                       blue = blue,
+                                       brightness = brightness,
+                                       contrast = contrast)
+        return image_tools.apply_table(image, table)
+
+    def enhance(self, image, color, sharpness):
+        """
+        Apply color-balance and sharpness.
+        """
+        if color != 1:
+            image = self.effect(image, 'Color', color)
+        if sharpness != 1:
+            image = self.effect(image, 'Sharpness', sharpness)
+        return image
+
+    def effect(self, image, effect, value):
+        """
+        Apply 'effect' to 'image'. The degenerate image the effect
+        blends with is computed once for every input, so moving a
+        slider only blends; the last result is kept as well, so that
+        moving the sharpness slider does not change the input of the
+        sharpness, i.e., the output of the color-balance.
+        """
+        cached = self.effects.get(effect)
+        if cached is None or cached[0] is not image:
+            cached = (image, image_tools.degenerate(image, effect), None, None)
+        elif cached[2] == value:
+            return cached[3]
+        result = image_tools.enhance(image, cached[1], value)
+        if self.cache_stages:
+            # Replaced at once, since the thumbnails of the filters
+            # render on several threads.
+            self.effects[effect] = cached[:2] + (value, result)
+        return result
+
+    def filter(self, image, names):
+        """
+        Apply the predefined filters, in order.
+        """
+        return image_tools.apply_filters(image, names)
+
+    def transparency(self, image, enabled):
+        """
+        Make all white pixels transparent.
+        """
+        if not enabled:
+            return image
+        return image_tools.make_transparent(image)
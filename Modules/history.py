@@ -0,0 +1,189 @@
+"""
+This module contains the undo/redo history of a picture.
+Changes of the edit parameters are stored as parameters only.
+Changes of the full resolution image (i.e., when the edits are
+applied) are stored as compressed differences between tiles.
+"""
+
+from contextlib import contextmanager
+import zlib
+
+from . import image_tools
+
+# Default memory budget of a History.
+MAX_BYTES = 256 * 2 ** 20
+TILE_SIZE = 256
+# Rough memory used by a step storing only parameters.
+PARAMS_BYTES = 512
+
+class EditStep:
+    """
+    Change of some edit parameters: 'before' and 'after' map
+    the name of each changed parameter to its values.
+    """
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+        self.nbytes = PARAMS_BYTES
+
+    def merge(self, name, before, after):
+        self.before.setdefault(name, before)
+        self.after[name] = after
+
+class SourceStep:
+    """
+    Change of the full resolution image. Only the tiles that
+    differ are stored, as the compressed difference between the
+    new and the old version. 'values' are the edit parameters in
+    use before the change. The step can be pushed before the
+    change is recorded (e.g., while the edits are being applied
+    on another thread).
+    """
+    def __init__(self, values):
+        self.values = dict(values)
+        self.tiles = []
+        self.nbytes = PARAMS_BYTES
+
+    def record(self, old, new):
+        """
+        Store the tiles of 'new' that differ from 'old'.
+        """
+        w, h = old.size
+        for y in range(0, h, TILE_SIZE):
+            for x in range(0, w, TILE_SIZE):
+                box = (x, y, min(x + TILE_SIZE, w), min(y + TILE_SIZE, h))
+                delta = image_tools.difference(new.crop(box),
+                                               old.crop(box)).tobytes()
+                if delta.count(0) != len(delta):
+                    tile = (box, zlib.compress(delta, 1))
+                    self.tiles.append(tile)
+                    self.nbytes += len(tile[1])
+
+    def patch(self, image, function):
+        """
+        Return a copy of 'image' with 'function' (adding or
+        subtracting a difference) applied to the tiles stored.
+        """
+        image = image.copy()
+        for box, data in self.tiles:
+            size = box[2] - box[0], box[3] - box[1]
+            delta = image_tools.from_bytes(image.mode, size,
+                                           zlib.decompress(data))
+            image.paste(function(image.crop(box), delta), box[:2])
+        return image
+
+    def undo(self, image):
+        return self.patch(image, image_tools.subtract_difference)
+
+    def redo(self, image):
+        return self.patch(image, image_tools.add_difference)
+
+class History:
+    """
+    Undo and redo stacks. When the memory used by the steps
+    exceeds 'max_bytes' the oldest steps are forgotten.
+    All the changes made inside a group (e.g., while a slider is
+    being dragged) are merged in a single step, every other change
+    is a step of its own. Changes that leave the parameters as they
+    were are dropped.
+    """
+    def __init__(self, max_bytes = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.undo_steps = []
+        self.redo_steps = []
+        self.grouping = False
+        self.group_step = None
+
+    def push(self, step):
+        """
+        Add a new step. The steps that could be redone are lost.
+        """
+        self.undo_steps.append(step)
+        self.redo_steps.clear()
+        self.trim()
+
+    def trim(self):
+        """
+        Forget the oldest steps while the memory used exceeds
+        'max_bytes' (e.g., once a step has been recorded).
+        """
+        while self.nbytes() > self.max_bytes and len(self.undo_steps) > 1:
+            self.undo_steps.pop(0)
+
+    def record_edit(self, name, before, after):
+        """
+        Record the change of the parameter 'name'.
+        """
+        if before == after:
+            return
+        if self.grouping and self.group_step is not None:
+            self.group_step.merge(name, before, after)
+            return
+        step = EditStep({name : before}, {name : after})
+        self.push(step)
+        if self.grouping:
+            self.group_step = step
+
+    def start_group(self):
+        """
+        Merge the changes recorded from now until end_group in one step.
+        """
+        self.grouping = True
+        self.group_step = None
+
+    def end_group(self):
+        """
+        Close the group started by start_group, dropping the
+        parameters that are back to their value before it.
+        """
+        step = self.group_step
+        self.grouping = False
+        self.group_step = None
+        if step is None:
+            return
+        for name in [name for name in step.after
+                     if step.before[name] == step.after[name]]:
+            del step.before[name], step.after[name]
+        if not step.after and step in self.undo_steps:
+            self.undo_steps.remove(step)
+
+    @contextmanager
+    def group(self):
+        """
+        Merge all the changes recorded inside the context in one step.
+        """
+        self.start_group()
+        try:
+            yield
+        finally:
+            self.end_group()
+
+    def undo(self):
+        """
+        Return the step to undo, or None.
+        """
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        return step
+
+    def redo(self):
+        """
+        Return the step to redo, or None.
+        """
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        return step
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+
+    def nbytes(self):
+        """
+        Memory used by all the steps.
+        """
+        return sum(step.nbytes for step in self.undo_steps + self.redo_steps)
@@ -3,15 +3,114 @@ This module contains all the PIL-related functions.
 Only in this module there are imports from the PIL library.
 """
 
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image,        \
                 ImageChops,   \
                 ImageEnhance, \
                 ImageFilter
+
+# Formats the images are opened as. Only their plugins are
+# registered: Pillow would otherwise import all of its plugins
+# the first time an image is not a jpeg or a png.
+FORMATS = ('JPEG', 'PNG', 'TIFF')
+
+# Names of the predefined filters in ImageFilter.
+FILTERS = ('BLUR', 'CONTOUR', 'DETAIL', 'EDGE_ENHANCE', 'EDGE_ENHANCE_MORE',
+           'EMBOSS', 'FIND_EDGES', 'SHARPEN', 'SMOOTH', 'SMOOTH_MORE')
+
+# Images with fewer pixels than this are processed in a single pass.
+TILED_MIN_PIXELS = 2 ** 21
+TILE_SIZE = 512
+# Pixels around each pixel that the sharpness depends on.
+SHARPNESS_HALO = 1
+
+# Encoder options for every output format, from the fastest to
+# save to the smallest file.
+SAVE_PRESETS = {'png' : {'Fast'     : {'compress_level' : 1},
+                         'Balanced' : {'compress_level' : 6},
+                         'Small'    : {'compress_level' : 9,
+                                       'optimize'       : True}},
+                'jpg' : {'Fast'     : {'quality'        : 90,
+                                       'subsampling'    : '4:2:0'},
+                         'Balanced' : {'quality'        : 90,
+                                       'subsampling'    : '4:2:0',
+                                       'optimize'       : True},
+                         'Small'    : {'quality'        : 75,
+                                       'subsampling'    : '4:2:0',
+                                       'optimize'       : True}},
+                'tif' : {'Fast'     : {'compression'    : None},
+                         'Balanced' : {'compression'    : 'tiff_lzw'},
+                         'Small'    : {'compression'    : 'tiff_adobe_deflate'}}}
+PRESETS = ('Fast', 'Balanced', 'Small')
+DEFAULT_PRESET = 'Balanced'
+
+_pool = None
+
+def get_pool():
+    """
+    Return the thread pool shared by the tiled operations.
+    Pillow releases the GIL while filtering, so the tiles
+    are processed in parallel.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers = os.cpu_count())
+    return _pool
+
+def map_tiles(image, function, halo, tile_size = TILE_SIZE):
+    """
+    Apply 'function' to 'image' tile by tile and stitch the results.
+    Each tile is extended by 'halo' pixels on every side, so local
+    operations (e.g., convolutions) give exactly the same result as
+    on the whole image.
+    """
+    w, h = image.size
+    if w * h < TILED_MIN_PIXELS or (os.cpu_count() or 1) == 1:
+        return function(image)
+
+    def run(box):
+        x0, y0, x1, y1 = box
+        hx0, hy0 = max(0, x0 - halo), max(0, y0 - halo)
+        hx1, hy1 = min(w, x1 + halo), min(h, y1 + halo)
+        tile = function(image.crop((hx0, hy0, hx1, hy1)))
+        return tile.crop((x0 - hx0, y0 - hy0, x1 - hx0, y1 - hy0))
+
+    boxes = [(x, y, min(x + tile_size, w), min(y + tile_size, h))
+             for y in range(0, h, tile_size) for x in range(0, w, tile_size)]
+    result = Image.new(image.mode, image.size)
+    for box, tile in zip(boxes, get_pool().map(run, boxes)):
+        result.paste(tile, box[:2])
+    return result
+
+def register_formats():
+    """
+    Register the plugins of the FORMATS, so that Pillow never
+    needs to look for the others, and load the modules of Pillow
+    imported lazily by the GUI: a lazy module must not be loaded
+    by several threads at once.
+    """
+    from PIL import JpegImagePlugin, \
+                    PngImagePlugin,  \
+                    TiffImagePlugin
+    for module in (Image, ImageChops, ImageEnhance, ImageFilter):
+        # Using an attribute executes the module.
+        module.__name__
+
+def open_image(fp):
+    """
+    Shortcut for Image.open, trying the FORMATS only.
+    """
+    register_formats()
+    return Image.open(fp, formats = FORMATS)
+
 def load_image(path):
     """
     Load selected image.
     """
-    im = Image.open(path)
+    im = open_image(path)
     return im
 
 def merge(channels, mode = "RGBA"):
@@ -20,18 +119,130 @@ def merge(channels, mode = "RGBA"):
     """
     return Image.merge(mode, channels)
 
+def open_preview(path, size):
+    """
+    Return a quick, reduced decode of the image at 'path' fitting
+    in 'size', converted to RGBA, and the size of the full image.
+    Only the formats that can be decoded at a reduced scale (e.g.,
+    jpeg) are supported: for the others the preview is None.
+    The reduced decode is at least half of 'size': the full
+    resolution image is expected to replace it shortly.
+    """
+    image = load_image(path)
+    full_size = image.size
+    w, h = size
+    if image.draft(None, (max(w // 2, 1), max(h // 2, 1))) is None:
+        return None, full_size
+    image = make_proxy(image, size)
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return image, full_size
+
 def prepare_image(path, pic):
     """
-    Convert loaded image to RGBA format.
+    Decode the image and convert it to RGBA format.
     """
     image = load_image(path)
+    image.load()
+    return to_rgba(image)
+
+def open_header(path):
+    """
+    Open the image at 'path' only to read its header, so without
+    the check against decompression bombs: the pixels of very big
+    images are decoded in parts.
+    """
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        return open_image(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+def image_size(path):
+    """
+    Size of the image at 'path', read without decoding it.
+    """
+    with open_header(path) as image:
+        return image.size
+
+def tiff_tags(path):
+    """
+    Return the tags of the first page of the TIFF image at 'path'
+    as {tag : (type, value)}, without decoding it, or None if it is
+    not a TIFF image.
+    """
+    with open_header(path) as image:
+        if image.format != 'TIFF':
+            return None
+        ifd = image.tag_v2
+        return {tag : (ifd.tagtype.get(tag), ifd[tag]) for tag in ifd}
+
+def decode_tiff(data):
+    """
+    Decode the TIFF file held in the bytes 'data' to RGBA.
+    """
+    image = open_image(io.BytesIO(data))
+    image.load()
+    return to_rgba(image)
+
+def to_rgba(image):
+    """
+    Convert loaded image to RGBA format.
+    """
     if image.mode == "L" or image.mode == 'RGB':
         image = image.convert("RGBA")
     if image.mode == "P":
         image = image.convert(mode = "RGBA", 
             palette = image.getpalette())
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
     return image
 
+def save_image(image, name, preset = DEFAULT_PRESET):
+    """
+    Save 'image' as 'name' with the encoder options of 'preset'
+    (see SAVE_PRESETS). The alpha band is dropped for jpeg and
+    tiff files.
+    """
+    extension = name[-3:].lower()
+    if extension == 'jpg' or extension == 'tif':
+        image = image.convert('RGB')
+    register_formats()
+    image.save(name, **SAVE_PRESETS.get(extension, {}).get(preset, {}))
+
+def fit_size(image_size, size):
+    """
+    Size of an image of 'image_size' reduced to fit in 'size'.
+    """
+    w, h = image_size
+    scale = min(size[0] / w, size[1] / h)
+    if scale >= 1:
+        return w, h
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+def make_proxy(image, size):
+    """
+    Return a copy of 'image' reduced to fit in 'size'.
+    Images that already fit are copied as they are.
+    """
+    proxy_size = fit_size(image.size, size)
+    if proxy_size == image.size:
+        return image.copy()
+    return image.resize(proxy_size, Image.BICUBIC, reducing_gap = 2.0)
+
+def crop_proxy(image, box, size):
+    """
+    Return the region 'box' of 'image' reduced to fit in 'size',
+    without copying the whole region first.
+    """
+    region_size = box[2] - box[0], box[3] - box[1]
+    proxy_size = fit_size(region_size, size)
+    if proxy_size == region_size:
+        return image.crop(box)
+    return image.resize(proxy_size, Image.BICUBIC, box = box,
+                        reducing_gap = 2.0)
+
 def get_data(original):
     """
     Get the image as a bytes object.
@@ -39,19 +250,57 @@ def get_data(original):
     data = original.tobytes("raw", "RGBA")
     return data
 
-def change_pixel_color(value):
+def tiles_data(image, size):
     """
-    Increase color channel by a fixed value.
+    Yield the box of every tile of 'image' of 'size'x'size' pixels
+    and its pixels, as bytes.
     """
-    def apply(x):
-        return x + value
-    return apply
+    w, h = image.size
+    for y in range(0, h, size):
+        for x in range(0, w, size):
+            box = (x, y, min(x + size, w), min(y + size, h))
+            yield box, get_data(image.crop(box))
 
-def equal(im1, im2):
+def from_bytes(mode, size, data):
     """
-    Returns whether two images are equal.
+    Shortcut for Image.frombytes.
     """
-    return ImageChops.difference(im1, im2).getbbox() is None
+    return Image.frombytes(mode, size, data)
+
+def from_buffer(mode, size, data):
+    """
+    Return an image of 'mode' and 'size' whose pixels are the buffer
+    'data' (e.g., a memory-mapped file), without copying it. The image
+    is read-only: operations that modify it in place copy it first.
+    """
+    return Image.frombuffer(mode, size, data, "raw", mode, 0, 1)
+
+def rows_data(image, rows):
+    """
+    Yield the pixels of 'image' as bytes, 'rows' rows at a time.
+    """
+    w, h = image.size
+    for y in range(0, h, rows):
+        yield get_data(image.crop((0, y, w, min(y + rows, h))))
+
+def difference(new, old):
+    """
+    Return 'new' - 'old', modulo 256 in every band: it is zero
+    where the images are the same, so it compresses well.
+    """
+    return ImageChops.subtract_modulo(new, old)
+
+def add_difference(image, delta):
+    """
+    Return 'image' + 'delta', modulo 256 in every band.
+    """
+    return ImageChops.add_modulo(image, delta)
+
+def subtract_difference(image, delta):
+    """
+    Return 'image' - 'delta', modulo 256 in every band.
+    """
+    return ImageChops.subtract_modulo(image, delta)
 
 def get_modes(pic):
     """
@@ -59,76 +308,161 @@ def get_modes(pic):
     """
     return pic.split()
 
-def change_RGB_color(pic, color, slider):
-    """
-    Increase the value of the channel 'color' of the displayed
-    image by an amount equal to 'slider.value()'.
-    """
-    r, g, b, _ = get_modes(pic.original)
-    dr, dg, db, alpha = get_modes(pic.to_display)
-    colors = 'red', 'green', 'blue'
-    modes = {'red' : r, 'green' : g, 'blue' : b}
-    dmodes = {'red' : dr, 'green' : dg, 'blue' : db}
-    m = {}
-    if all([equal(modes[i], dmodes[i]) for i in colors if i != color]):
-        m = modes
-    else:
-        m[color] = modes[color]
-        for i in colors:
-            if i != color:
-                m[i] = dmodes[i]
-    m[color] = m[color].point(change_pixel_color(slider.value()))
-    cache_colors = (m[colors[0]], m[colors[1]], m[colors[2]], alpha)
-    return merge(cache_colors)
-
-def change_effect(pic, slider, effect, effects):
-    """
-    Apply an effect to the displayed image.
-    """
-    check_effects = {}
-    for k, v in effects.items():
-        if k != effect:
-            check_effects[k] = v
-    if any(check_effects.values()):
-        pic.cache_colors = get_modes(pic.to_display)
-        for attr in check_effects.keys():
-            effects[attr] = False
-    image = merge(pic.cache_colors)
-    effects[effect] = True
-    enh = getattr(ImageEnhance, effect)(image)
-    return enh.enhance(slider.value())
-
-def apply_filter(pic, name):
-    """
-    Apply a predefined filter to the displayed image.
-    """
-    return pic.to_display.filter(getattr(ImageFilter, name))
-
-def make_transparent(pic):
-    """
-    Make all white pixels transparent.
-    """
-    data = pic.to_display.getdata()
-    trsp_image_data = []
-    for pix in data:
-        if pix[:3] == (255, 255, 255):
-            trsp_image_data.append((255, 255, 255, 0))
+def blend_value(a, b, alpha):
+    """
+    Blend two pixel values the way Image.blend does.
+    """
+    value = a + alpha * (b - a)
+    if 0 <= alpha <= 1:
+        return int(value)
+    if value <= 0:
+        return 0
+    if value >= 255:
+        return 255
+    return int(value)
+
+def tone_table(histogram, red = 0, green = 0, blue = 0,
+               brightness = 1.0, contrast = 1.0):
+    """
+    Build the lookup table that changes the color bands by the given
+    offsets and then applies brightness and contrast (as ImageEnhance
+    would do), for an RGBA image.
+    'histogram' is the histogram of the image the table is applied to:
+    the mean needed by the contrast is computed from it, so it can be
+    cached and the image is never visited.
+    """
+    tables = [[blend_value(0, min(255, max(0, i + offset)), brightness)
+               for i in range(256)] for offset in (red, green, blue)]
+    if contrast != 1:
+        count = sum(histogram[:256])
+        means = [sum(n * v for n, v in zip(histogram[256 * k:256 * (k + 1)],
+                                           table)) / count
+                 for k, table in enumerate(tables)]
+        # Same weights used by Pillow to convert to grayscale.
+        gray = (19595 * means[0] + 38470 * means[1] + 7471 * means[2]) / 65536
+        mean = int(gray + 0.5)
+        tables = [[blend_value(mean, v, contrast) for v in table]
+                  for table in tables]
+    return tables[0] + tables[1] + tables[2] + list(range(256))
+
+def apply_table(image, table):
+    """
+    Shortcut for Image.point.
+    """
+    return image.point(table)
+
+def get_histogram(image):
+    """
+    Shortcut for Image.histogram.
+    """
+    return image.histogram()
+
+def change_effect(image, effect, value):
+    """
+    Apply an effect (e.g., color-balance) to 'image'.
+    """
+    return enhance(image, degenerate(image, effect), value)
+
+def degenerate(image, effect):
+    """
+    Return the image that the effect 'effect' of ImageEnhance blends
+    'image' with (e.g., its grayscale copy for 'Color'). It does not
+    depend on the amount of the effect, so it can be computed once
+    and blended with any amount (see enhance).
+    The grayscale and the smoothed copies are computed in tiles,
+    in parallel.
+    """
+    if effect == 'Color':
+        intermediate = 'LA' if 'A' in image.getbands() else 'L'
+        return map_tiles(image,
+            lambda im: im.convert(intermediate).convert(im.mode), 0)
+    if effect == 'Sharpness':
+        # Sharpness blends with a 3x3 smoothed copy of the image.
+        result = map_tiles(image, lambda im: im.filter(ImageFilter.SMOOTH),
+                           SHARPNESS_HALO)
+        if 'A' in image.getbands():
+            result.putalpha(image.getchannel('A'))
+        return result
+    return getattr(ImageEnhance, effect)(image).degenerate
+
+def enhance(image, degenerate_, value):
+    """
+    Apply an effect to 'image' by blending it with its 'degenerate_'
+    image, the way ImageEnhance does.
+    """
+    return Image.blend(degenerate_, image, value)
+
+def apply_filter(image, name):
+    """
+    Apply a predefined filter to 'image', keeping its alpha band.
+    """
+    return apply_filters(image, (name,))
+
+def apply_filters(image, names):
+    """
+    Apply the predefined filters 'names' to 'image', one after the
+    other, keeping its alpha band.
+    The whole stack is applied to each tile in turn, so the image is
+    split, stitched and merged with its alpha band only once and
+    every tile is still in cache when the next filter reads it.
+    Only the color bands are filtered: some filters (e.g.,
+    FIND_EDGES) do not work properly on the alpha band, which
+    is kept anyway.
+    """
+    if not names:
+        return image
+    alpha = image.getchannel("A")
+    kernels = [getattr(ImageFilter, name) for name in names]
+
+    def run(im):
+        for kernel in kernels:
+            im = im.filter(kernel)
+        return im
+
+    halo = sum(filter_halo(name) for name in names)
+    image = map_tiles(image.convert("RGB"), run, halo)
+    image.putalpha(alpha)
+    return image
+
+def filter_halo(name):
+    """
+    Pixels around each pixel that the filter 'name' depends on.
+    """
+    return getattr(ImageFilter, name).filterargs[0][0] // 2
+
+def replace_alpha(image, alpha):
+    """
+    Return a copy of 'image' with a new alpha band. The images
+    are never modified in place, since the same image can be
+    shared by several stages of the edits.
+    """
+    image = image.copy()
+    image.putalpha(alpha)
+    return image
+
+def color_mask(image, key = (255, 255, 255), tolerance = 0):
+    """
+    Return a 1-bit mask of the pixels whose red, green and blue
+    values are all within 'tolerance' of the colour 'key'.
+    The mask is built one band at a time with a lookup table, so
+    no pixel is ever visited from python.
+    """
+    mask = None
+    for band, value in zip("RGB", key):
+        table = [255 if abs(i - value) <= tolerance else 0 for i in range(256)]
+        band_mask = image.getchannel(band).point(table, "1")
+        if mask is None:
+            mask = band_mask
         else:
-            trsp_image_data.append(pix)
-    pic.white_pixels = (index for index, pix in enumerate(data) if pix[:3] == (255, 255, 255))
-    # Because of this line, pic.original must always be
-    # copied, otherwise putdata will modify also pic.original
-    # since pic.to_display would point to pic.original.
-    pic.to_display.putdata(trsp_image_data)
-
-def reset_alpha(pic):
-    """
-    Restore the original white pixels before the call 
-    to 'make_transparent'.
-    """
-    if pic.white_pixels:
-        data = list(pic.to_display.getdata())
-        for i in pic.white_pixels:
-            data[i] = (255, 255, 255, 0)
-        pic.to_display.putdata(data)
-        pic.to_display.putalpha(pic.original_alpha)
+            mask = ImageChops.logical_and(mask, band_mask)
+    return mask
+
+def make_transparent(image, key = (255, 255, 255), tolerance = 0):
+    """
+    Return a copy of 'image' where all pixels matching the colour
+    'key' (white by default) are transparent.
+    """
+    mask = color_mask(image, key, tolerance)
+    alpha = image.getchannel("A")
+    alpha.paste(0, mask = mask)
+    return replace_alpha(image, alpha)
@@ -0,0 +1,149 @@
+"""
+Lightweight timing of the hot paths (slider callbacks, renders,
+conversion for Qt, repaint).
+The spans are kept in a ring buffer and can be summarized (last,
+average and 95th percentile per name, frames per second) or exported
+as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+When disabled, a timed function costs one flag check.
+"""
+
+from collections import deque
+from functools import wraps
+import json
+import os
+import threading
+import time
+
+RING_SIZE = 4096
+
+enabled = False
+_spans = deque(maxlen = RING_SIZE)
+_frames = deque(maxlen = 256)
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        _spans.append((self.name, self.start, end - self.start,
+                       threading.get_ident()))
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def enable(flag = True):
+    global enabled
+    enabled = flag
+
+def clear():
+    _spans.clear()
+    _frames.clear()
+
+def span(name):
+    """
+    Context manager timing the code it wraps as 'name'.
+    """
+    return _Span(name) if enabled else _NULL_SPAN
+
+def timed(name):
+    """
+    Decorator timing every call of the function as 'name'.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def frame():
+    """
+    Record that a frame has been displayed.
+    """
+    if enabled:
+        _frames.append(time.perf_counter_ns())
+
+def fps(window = 1.0):
+    """
+    Frames displayed per second during the last 'window' seconds.
+    """
+    now = time.perf_counter_ns()
+    start = now - int(window * 1e9)
+    return sum(1 for t in _frames if t >= start) / window
+
+def memory():
+    """
+    Return the resident memory of the process and the part of it
+    backed by files (e.g., the images mapped from the decode cache,
+    which the system can drop and read again), in bytes, or None
+    where it is not available (linux only).
+    """
+    values = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'RssFile:')):
+                    name, value = line.split()[:2]
+                    values[name] = int(value) * 1024
+    except OSError:
+        return None
+    if 'VmRSS:' not in values:
+        return None
+    return values['VmRSS:'], values.get('RssFile:', 0)
+
+def stats():
+    """
+    Return {name : (last, average, 95th percentile)} in milliseconds.
+    """
+    durations = {}
+    for name, _, duration, _ in list(_spans):
+        durations.setdefault(name, []).append(duration / 1e6)
+    result = {}
+    for name, values in durations.items():
+        ordered = sorted(values)
+        p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        result[name] = (values[-1], sum(values) / len(values), p95)
+    return result
+
+def summary():
+    """
+    One line description of stats() and fps().
+    """
+    parts = [f'{name} {last:.1f}/{avg:.1f}/{p95:.1f}'
+             for name, (last, avg, p95) in sorted(stats().items())]
+    parts.append(f'{fps():.0f} fps')
+    return 'ms last/avg/p95: ' + ', '.join(parts)
+
+def export_chrome_trace(path):
+    """
+    Write the spans in the ring buffer as a Chrome trace json file.
+    """
+    pid = os.getpid()
+    events = [{'name' : name,
+               'ph'   : 'X',
+               'ts'   : start / 1000,
+               'dur'  : duration / 1000,
+               'pid'  : pid,
+               'tid'  : tid}
+              for name, start, duration, tid in list(_spans)]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
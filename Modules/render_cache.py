@@ -0,0 +1,76 @@
+"""
+This module contains the cache of the rendered images.
+"""
+
+from collections import OrderedDict
+import threading
+
+# Default memory budget of a RenderCache.
+MAX_BYTES = 256 * 2 ** 20
+
+def image_bytes(image):
+    """
+    Memory used by the pixels of 'image'.
+    """
+    w, h = image.size
+    return w * h * len(image.getbands())
+
+class RenderCache:
+    """
+    Least recently used cache of rendered images, bounded by the
+    memory used by the pixels. The keys are built by the Pipeline
+    from the source, the edit parameters and the output size.
+    """
+    def __init__(self, max_bytes = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the image stored with 'key', or None.
+        """
+        with self.lock:
+            image = self.entries.get(key)
+            if image is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        """
+        Store 'image', evicting the least recently used images
+        if the budget is exceeded. Images bigger than the whole
+        budget are not stored.
+        """
+        size = image_bytes(image)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= image_bytes(self.entries.pop(key))
+            self.entries[key] = image
+            self.size += size
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last = False)
+                self.size -= image_bytes(old)
+
+    def clear(self):
+        """
+        Remove all the images. The counters are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Return hits, misses, number of images and bytes used.
+        """
+        with self.lock:
+            return self.hits, self.misses, len(self.entries), self.size
@@ -0,0 +1,72 @@
+"""
+This module contains the scheduler running the image computations
+away from the GUI thread.
+"""
+
+import threading
+import traceback
+
+class RenderScheduler:
+    """
+    Run jobs on a background thread, one at a time and in the order
+    they are submitted. A job submitted with a key replaces the
+    pending jobs with the same key, so that superseded requests
+    (e.g., old values of a slider being dragged) never run.
+    'on_idle' is called on the background thread every time the
+    queue of pending jobs becomes empty.
+    """
+    def __init__(self, on_idle = None):
+        self.on_idle = on_idle
+        self.pending = []
+        self.busy = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def submit(self, job, *args, key = None):
+        """
+        Queue 'job(*args)'.
+        """
+        with self.condition:
+            if key is not None:
+                self.pending = [pending for pending in self.pending
+                                if pending[0] != key]
+            self.pending.append((key, job, args))
+            self.condition.notify_all()
+
+    def cancel(self):
+        """
+        Drop all the pending jobs. The running one, if any, is
+        completed.
+        """
+        with self.condition:
+            self.pending.clear()
+
+    def wait(self, timeout = None):
+        """
+        Block until all the submitted jobs are done.
+        Return False if 'timeout' expires first.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.pending and not self.busy, timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                _, job, args = self.pending.pop(0)
+                self.busy = True
+            try:
+                job(*args)
+                with self.condition:
+                    idle = not self.pending
+                if idle and self.on_idle:
+                    self.on_idle()
+            except Exception:
+                traceback.print_exc()
+            # Do not hold the images of the last job while waiting.
+            del job, args
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
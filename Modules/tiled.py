@@ -0,0 +1,342 @@
+"""
+Out-of-core processing of large TIFF images.
+The image is read a band of rows at a time, only decoding the strips
+(or tiles) of the file the band needs, the edits are rendered on each
+band together with the few rows around it that the sharpness and the
+filters depend on, and the result is written as a tiled TIFF, one
+row of tiles at a time. The memory used depends on the width of the
+image and on the budget, not on its height.
+"""
+
+import io
+import struct
+import zlib
+
+from . import edits
+from . import image_tools
+
+# Default memory budget, in bytes.
+MEMORY_BUDGET = 1024 * 2 ** 20
+TILE_SIZE = 256
+# RGBA copies of a band alive at the same time while it is rendered.
+BAND_COPIES = 8
+# Deflate level of the output for each preset, None for no compression.
+DEFLATE_LEVELS = {'Fast' : None, 'Balanced' : 6, 'Small' : 9}
+
+# TIFF tags.
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+FILL_ORDER = 266
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+COLOR_MAP = 320
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+EXTRA_SAMPLES = 338
+SAMPLE_FORMAT = 339
+JPEG_TABLES = 347
+YCBCR_SUBSAMPLING = 530
+
+# Tags copied from the input to decode a part of it.
+DECODING_TAGS = (BITS_PER_SAMPLE, COMPRESSION, PHOTOMETRIC, FILL_ORDER,
+                 SAMPLES_PER_PIXEL, PLANAR_CONFIGURATION, PREDICTOR,
+                 COLOR_MAP, EXTRA_SAMPLES, SAMPLE_FORMAT, JPEG_TABLES,
+                 YCBCR_SUBSAMPLING)
+
+# TIFF types: struct format of each value.
+BYTE, ASCII, SHORT, LONG, UNDEFINED, LONG8 = 1, 2, 3, 4, 7, 16
+FORMATS = {BYTE : 'B', SHORT : 'H', LONG : 'I', UNDEFINED : 'B', LONG8 : 'Q'}
+
+def as_tuple(value):
+    return value if isinstance(value, tuple) else (value,)
+
+def write_ifd(f, entries, big = False):
+    """
+    Write a TIFF directory with 'entries' (tag, type, values) at the
+    current position of 'f' (after the values that do not fit in
+    it). Return the position of the directory.
+    """
+    inline = 8 if big else 4
+    offset_format = '<Q' if big else '<I'
+    fields = []
+    for tag, kind, values in sorted(entries, key = lambda e: e[0]):
+        data = (bytes(values) if isinstance(values, bytes) else
+                struct.pack(f'<{len(values)}{FORMATS[kind]}', *values))
+        if len(data) > inline:
+            if f.tell() % 2:
+                f.write(b'\0')
+            field = struct.pack(offset_format, f.tell())
+            f.write(data)
+        else:
+            field = data.ljust(inline, b'\0')
+        fields.append((tag, kind, len(values), field))
+    if f.tell() % 2:
+        f.write(b'\0')
+    position = f.tell()
+    f.write(struct.pack('<Q' if big else '<H', len(fields)))
+    for tag, kind, count, field in fields:
+        f.write(struct.pack('<HHQ' if big else '<HHI', tag, kind, count) + field)
+    f.write(struct.pack(offset_format, 0))
+    return position
+
+def write_header(f, big = False):
+    """
+    Write the header of a TIFF file. Return the position of the
+    offset of the first directory, to be filled later.
+    """
+    if big:
+        f.write(b'II+\0' + struct.pack('<HH', 8, 0))
+        position = f.tell()
+        f.write(struct.pack('<Q', 0))
+    else:
+        f.write(b'II*\0')
+        position = f.tell()
+        f.write(struct.pack('<I', 0))
+    return position
+
+def link_ifd(f, position, ifd, big = False):
+    f.seek(position)
+    f.write(struct.pack('<Q' if big else '<I', ifd))
+
+class TiffReader:
+    """
+    Read bands of rows of a TIFF image. Only the strips or tiles
+    covering a band are read from the file: they are wrapped in a
+    small TIFF file in memory, with the tags needed to decode them,
+    and decoded by Pillow. The strips last decoded are kept, since
+    they can be taller than a band. The layouts that cannot be read
+    in parts (e.g., separate planes, or a single compressed strip)
+    are decoded whole the first time.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tags = image_tools.tiff_tags(path) or {}
+        self.size = image_tools.image_size(path)
+        self.whole = None
+        # First and last strip decoded, and their image.
+        self.decoded = None
+        value = lambda tag, default = None: self.tags.get(tag, (None, default))[1]
+        self.tiled = TILE_OFFSETS in self.tags
+        self.offsets = as_tuple(value(TILE_OFFSETS if self.tiled else STRIP_OFFSETS, ()))
+        self.counts = as_tuple(value(TILE_BYTE_COUNTS if self.tiled else STRIP_BYTE_COUNTS, ()))
+        self.compression = value(COMPRESSION, 1)
+        bits = sum(as_tuple(value(BITS_PER_SAMPLE, 1)))
+        self.row_bytes = (self.size[0] * bits + 7) // 8
+        if self.tiled:
+            self.tile = value(TILE_WIDTH), value(TILE_LENGTH)
+            self.rows = self.tile[1]
+        else:
+            self.rows = min(value(ROWS_PER_STRIP, self.size[1]), self.size[1])
+        self.streamed = (bool(self.tags) and value(PLANAR_CONFIGURATION, 1) == 1
+                         and bool(self.offsets) and len(self.offsets) == len(self.counts)
+                         # Old style jpeg.
+                         and self.compression != 6
+                         and (self.tiled or self.compression == 1
+                              or self.rows < self.size[1]))
+
+    def read(self, y0, y1):
+        """
+        Return the rows from 'y0' to 'y1' as an RGBA image.
+        """
+        if not self.streamed:
+            if self.whole is None:
+                self.whole = image_tools.prepare_image(self.path, None)
+            return self.whole.crop((0, y0, self.size[0], y1))
+        with open(self.path, 'rb') as f:
+            if self.tiled:
+                return self.read_tiles(f, y0, y1)
+            if self.compression == 1:
+                return self.read_rows(f, y0, y1)
+            return self.read_strips(f, y0, y1)
+
+    def read_rows(self, f, y0, y1):
+        """
+        Read uncompressed rows, whatever the size of the strips.
+        """
+        data = bytearray()
+        for strip, (offset, count) in enumerate(zip(self.offsets, self.counts)):
+            top = strip * self.rows
+            r0, r1 = max(y0, top), min(y1, top + self.rows)
+            if r0 < r1:
+                f.seek(offset + (r0 - top) * self.row_bytes)
+                data += f.read((r1 - r0) * self.row_bytes)
+        return self.decode(self.size[0], y1 - y0, [bytes(data)], y1 - y0)
+
+    def read_strips(self, f, y0, y1):
+        """
+        Read the compressed strips covering the rows.
+        """
+        first, last = y0 // self.rows, (y1 - 1) // self.rows
+        top = first * self.rows
+        if self.decoded is None or self.decoded[0] != (first, last):
+            strips = [self.chunk(f, i) for i in range(first, last + 1)]
+            height = min(self.size[1], (last + 1) * self.rows) - top
+            self.decoded = ((first, last),
+                            self.decode(self.size[0], height, strips, self.rows))
+        return self.decoded[1].crop((0, y0 - top, self.size[0], y1 - top))
+
+    def read_tiles(self, f, y0, y1):
+        """
+        Read the rows of tiles covering the rows.
+        """
+        across = -(-self.size[0] // self.tile[0])
+        first, last = y0 // self.rows, (y1 - 1) // self.rows
+        tiles = [self.chunk(f, i)
+                 for i in range(first * across, (last + 1) * across)]
+        top = first * self.rows
+        height = min(self.size[1], (last + 1) * self.rows) - top
+        image = self.decode(self.size[0], height, tiles, None)
+        return image.crop((0, y0 - top, self.size[0], y1 - top))
+
+    def chunk(self, f, index):
+        f.seek(self.offsets[index])
+        return f.read(self.counts[index])
+
+    def decode(self, width, height, chunks, rows):
+        """
+        Decode 'chunks' (strips of 'rows' rows, or tiles if 'rows'
+        is None) of an image of 'width' x 'height' pixels.
+        """
+        f = io.BytesIO()
+        position = write_header(f)
+        entries = [(IMAGE_WIDTH, LONG, (width,)), (IMAGE_LENGTH, LONG, (height,))]
+        for tag in DECODING_TAGS:
+            if tag in self.tags:
+                kind, value = self.tags[tag]
+                if isinstance(value, bytes):
+                    entries.append((tag, UNDEFINED, value))
+                elif kind in FORMATS:
+                    entries.append((tag, kind, as_tuple(value)))
+        if rows is None:
+            entries += [(TILE_WIDTH, LONG, (self.tile[0],)),
+                        (TILE_LENGTH, LONG, (self.tile[1],))]
+        else:
+            entries.append((ROWS_PER_STRIP, LONG, (rows,)))
+        offsets = []
+        for chunk in chunks:
+            offsets.append(f.tell())
+            f.write(chunk)
+        counts = tuple(len(chunk) for chunk in chunks)
+        entries += [(TILE_OFFSETS if rows is None else STRIP_OFFSETS,
+                     LONG, tuple(offsets)),
+                    (TILE_BYTE_COUNTS if rows is None else STRIP_BYTE_COUNTS,
+                     LONG, counts)]
+        link_ifd(f, position, write_ifd(f, entries))
+        return image_tools.decode_tiff(f.getvalue())
+
+class TiffWriter:
+    """
+    Write an RGB image as a tiled TIFF, a row of tiles at a time.
+    The tiles are compressed with deflate ('level' None for no
+    compression). A BigTIFF file is written when a classic one could
+    exceed 4 GB.
+    """
+    def __init__(self, path, size, tile_size = TILE_SIZE, level = 6):
+        self.size = size
+        self.tile_size = tile_size
+        self.level = level
+        self.offsets = []
+        self.counts = []
+        tiles = -(-size[0] // tile_size) * -(-size[1] // tile_size)
+        self.big = tiles * tile_size ** 2 * 3 > 2 ** 32 - 2 ** 24
+        self.f = open(path, 'wb')
+        self.position = write_header(self.f, self.big)
+
+    def write(self, band):
+        """
+        Append 'band', a row of tiles (the last one can be shorter).
+        """
+        band = band.convert('RGB')
+        size = self.tile_size
+        for x in range(0, self.size[0], size):
+            # Parts of the tiles outside the image are left black.
+            data = band.crop((x, 0, x + size, size)).tobytes()
+            if self.level is not None:
+                data = zlib.compress(data, self.level)
+            self.offsets.append(self.f.tell())
+            self.counts.append(len(data))
+            self.f.write(data)
+
+    def close(self):
+        count_type = LONG8 if self.big else LONG
+        entries = [(IMAGE_WIDTH, LONG, (self.size[0],)),
+                   (IMAGE_LENGTH, LONG, (self.size[1],)),
+                   (BITS_PER_SAMPLE, SHORT, (8, 8, 8)),
+                   (COMPRESSION, SHORT, (1 if self.level is None else 8,)),
+                   (PHOTOMETRIC, SHORT, (2,)),
+                   (SAMPLES_PER_PIXEL, SHORT, (3,)),
+                   (PLANAR_CONFIGURATION, SHORT, (1,)),
+                   (TILE_WIDTH, LONG, (self.tile_size,)),
+                   (TILE_LENGTH, LONG, (self.tile_size,)),
+                   (TILE_OFFSETS, count_type, tuple(self.offsets)),
+                   (TILE_BYTE_COUNTS, count_type, tuple(self.counts))]
+        ifd = write_ifd(self.f, entries, self.big)
+        link_ifd(self.f, self.position, ifd, self.big)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+def band_rows(width, halo, budget, tile_size = TILE_SIZE):
+    """
+    Rows of the bands processed at a time, a multiple of 'tile_size'.
+    """
+    rows = budget // (width * 4 * BAND_COPIES) - 2 * halo
+    return max(tile_size, rows // tile_size * tile_size)
+
+def needed(path, budget = MEMORY_BUDGET):
+    """
+    Whether the image at 'path' is a TIFF too big to be edited
+    in memory within 'budget'.
+    """
+    if path[-3:].lower() != 'tif' and path[-4:].lower() != 'tiff':
+        return False
+    w, h = image_tools.image_size(path)
+    return w * h * 4 * BAND_COPIES > budget
+
+def histogram(reader, rows):
+    """
+    Histogram of the whole image, read a band at a time.
+    """
+    w, h = reader.size
+    total = None
+    for y in range(0, h, rows):
+        counts = image_tools.get_histogram(reader.read(y, min(h, y + rows)))
+        total = counts if total is None else [a + b for a, b in zip(total, counts)]
+    return total
+
+def process(path, name, edits_, budget = MEMORY_BUDGET,
+            preset = image_tools.DEFAULT_PRESET, tile_size = TILE_SIZE):
+    """
+    Render 'edits_' on the TIFF image at 'path' and save it as the
+    tiled TIFF 'name', keeping the memory used around 'budget'.
+    """
+    reader = TiffReader(path)
+    w, h = reader.size
+    halo = edits_.halo()
+    rows = band_rows(w, halo, budget, tile_size)
+    # The histogram is only needed by the contrast.
+    counts = histogram(reader, rows) if edits_['Contrast'] != 1 else ()
+    with TiffWriter(name, (w, h), tile_size, DEFLATE_LEVELS[preset]) as writer:
+        for y0 in range(0, h, rows):
+            y1 = min(h, y0 + rows)
+            top, bottom = max(0, y0 - halo), min(h, y1 + halo)
+            band = edits.Pipeline(reader.read(top, bottom), histogram = counts,
+                                  cache_stages = False).render(edits_)
+            band = band.crop((0, y0 - top, w, y1 - top))
+            for y in range(0, y1 - y0, tile_size):
+                writer.write(band.crop((0, y, w, min(y1 - y0, y + tile_size))))
+    return reader.streamed
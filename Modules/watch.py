@@ -0,0 +1,294 @@
+"""
+Watch a folder and edit every image written into it, without the GUI.
+
+Usage:
+    python pycture.py watch FOLDER -o OUTPUT_DIR [options]
+
+The folder is scanned every --interval seconds. A new image is queued
+once its size and modification time have not changed for --settle
+seconds (i.e., it has been fully written), and the queued images are
+processed on a pool of processes, keeping at most --max-in-flight of
+them submitted at the same time. The edits and the output options
+are the same as in batch mode.
+The images processed are recorded in a json state file (by default
+in the output directory), so that after a restart only the new or
+changed images are processed. The counters (images done and failed,
+throughput, queue depth) are printed every --stats seconds and kept
+in the state file.
+An image that would be saved as the output of another one (e.g.,
+'a.png' and 'a.jpg' with --format png) is recorded as failed.
+SIGINT or SIGTERM stop the scanning and wait for the images being
+processed; a second signal stops at once.
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, \
+                               FIRST_COMPLETED,     \
+                               wait
+
+from . import batch
+
+STATE_NAME = '.pycture-watch.json'
+# Seconds over which the recent throughput is measured.
+THROUGHPUT_WINDOW = 60
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog = 'pycture.py watch',
+        description = 'Edit every image written into a folder.')
+    parser.add_argument('folder', help = 'folder to watch')
+    batch.add_arguments(parser)
+    parser.add_argument('--interval', type = float, default = 1.0,
+        help = 'seconds between two scans of the folder (default: %(default)s)')
+    parser.add_argument('--settle', type = float, default = 2.0,
+        help = 'seconds a file must stay unchanged before it is processed '
+               '(default: %(default)s)')
+    parser.add_argument('--state',
+        help = f'json state file (default: OUTPUT_DIR/{STATE_NAME})')
+    parser.add_argument('--stats', type = float, default = 10.0,
+        help = 'seconds between two reports of the counters '
+               '(default: %(default)s)')
+    return parser.parse_args(argv)
+
+class State:
+    """
+    Images already processed (or failed), with the size and the
+    modification time they had, saved as json.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.done = data.get('done', {})
+            self.failed = data.get('failed', {})
+
+    def seen(self, name, signature):
+        """
+        Whether the image 'name' was already processed (or failed)
+        with the same 'signature' (size and modification time).
+        """
+        entry = self.done.get(name) or self.failed.get(name)
+        return entry is not None and entry['signature'] == list(signature)
+
+    def record(self, name, signature, **info):
+        info['signature'] = list(signature)
+        failed = 'error' in info
+        (self.failed if failed else self.done)[name] = info
+        (self.done if failed else self.failed).pop(name, None)
+
+    def save(self, counters):
+        """
+        Write the state atomically.
+        """
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'done'     : self.done,
+                       'failed'   : self.failed,
+                       'counters' : counters}, f, indent = 1)
+        os.replace(temporary, self.path)
+
+class Counters:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.recent = deque()
+
+    def finished(self, size):
+        now = time.monotonic()
+        self.done += 1
+        self.bytes += size
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - THROUGHPUT_WINDOW:
+            self.recent.popleft()
+
+    def report(self, waiting, in_flight):
+        """
+        Return the counters as a dictionary.
+        """
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        window = min(elapsed, THROUGHPUT_WINDOW)
+        return {'done'            : self.done,
+                'failed'          : self.failed,
+                'waiting'         : waiting,
+                'in_flight'       : in_flight,
+                'images_per_s'    : round(self.done / elapsed, 3),
+                'recent_per_s'    : round(len(self.recent) / window, 3),
+                'input_MB_per_s'  : round(self.bytes / elapsed / 2 ** 20, 3),
+                'uptime_s'        : round(elapsed, 1)}
+
+class Watcher:
+    """
+    Scan the folder, queue the images once they are fully written
+    and keep the pool of workers busy.
+    """
+    def __init__(self, folder, output, values, fmt, preset, budget,
+                 state, settle, out = sys.stdout):
+        self.folder = folder
+        self.output = output
+        self.values = values
+        self.fmt = fmt
+        self.preset = preset
+        self.budget = budget
+        self.state = state
+        self.settle = settle
+        self.out = out
+        # Files not yet settled: name -> (signature, time first seen).
+        self.candidates = {}
+        # Files settled and waiting for a worker.
+        self.queue = deque()
+        self.queued = set()
+        # Future -> (name, signature, output name, start time).
+        self.pending = {}
+        # Output name -> name of the image saved (or being saved) as it.
+        self.outputs = {info['output'] : name
+                        for name, info in state.done.items()}
+        self.counters = Counters()
+        self.stopping = False
+
+    def scan(self):
+        """
+        Queue the images whose size and modification time have not
+        changed for 'settle' seconds.
+        """
+        now = time.monotonic()
+        found = set()
+        for entry in os.scandir(self.folder):
+            if (not entry.is_file()
+                or entry.name[-3:].lower() not in batch.EXTENSIONS):
+                continue
+            name = entry.name
+            found.add(name)
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if name in self.queued or self.state.seen(name, signature):
+                continue
+            seen = self.candidates.get(name)
+            if seen is None or seen[0] != signature:
+                self.candidates[name] = (signature, now)
+            elif now - seen[1] >= self.settle:
+                del self.candidates[name]
+                self.queue.append((name, signature))
+                self.queued.add(name)
+        for name in set(self.candidates) - found:
+            del self.candidates[name]
+
+    def submit(self, pool, max_in_flight):
+        """
+        Hand queued images to the pool without exceeding 'max_in_flight'.
+        An image whose output name is already the output of another
+        one fails. Return whether the state changed.
+        """
+        changed = False
+        while self.queue and len(self.pending) < max_in_flight:
+            name, signature = self.queue.popleft()
+            path = os.path.join(self.folder, name)
+            target = batch.output_name(path, self.output, self.fmt)
+            owner = self.outputs.setdefault(target, name)
+            if owner != name:
+                # e.g., 'a.png' and 'a.jpg' with the same format.
+                error = f'{target} is the output of {owner}'
+                self.counters.failed += 1
+                self.state.record(name, signature, error = error)
+                self.queued.discard(name)
+                print(f'FAILED  {name}: {error}', file = self.out)
+                changed = True
+                continue
+            future = pool.submit(batch.process, path, self.values, target,
+                                 self.preset, self.budget)
+            self.pending[future] = (name, signature, target, time.monotonic())
+        return changed
+
+    def collect(self, timeout):
+        """
+        Wait up to 'timeout' seconds for images to be processed and
+        record them. Return whether the state changed.
+        """
+        if not self.pending:
+            time.sleep(timeout)
+            return False
+        done, _ = wait(self.pending, timeout = timeout,
+                       return_when = FIRST_COMPLETED)
+        for future in done:
+            name, signature, target, start = self.pending.pop(future)
+            self.queued.discard(name)
+            seconds = time.monotonic() - start
+            try:
+                future.result()
+            except Exception as e:
+                self.counters.failed += 1
+                self.state.record(name, signature, error = str(e))
+                print(f'FAILED  {name}: {e}', file = self.out)
+                continue
+            self.counters.finished(signature[0])
+            self.state.record(name, signature, output = target,
+                              seconds = round(seconds, 3))
+            print(f'{seconds:8.3f}s  {name} -> {target}', file = self.out)
+        return bool(done)
+
+    def report(self):
+        return self.counters.report(len(self.queue), len(self.pending))
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            raise KeyboardInterrupt
+        self.stopping = True
+        print('Stopping: waiting for the images being processed '
+              '(signal again to stop at once).', file = self.out)
+
+def init_worker():
+    # The daemon decides when the workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    batch.init_worker()
+
+def main(argv):
+    args = parse_args(argv)
+    values, fmt = batch.load_recipe(args)
+    if not os.path.isdir(args.folder):
+        print(f'Not a folder: {args.folder}', file = sys.stderr)
+        return 1
+    if os.path.abspath(args.folder) == os.path.abspath(args.output):
+        print('The output directory must not be the watched folder',
+              file = sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok = True)
+    state = State(args.state or os.path.join(args.output, STATE_NAME))
+    jobs = max(1, args.jobs or 1)
+    max_in_flight = max(1, args.max_in_flight or 2 * jobs)
+    watcher = Watcher(args.folder, args.output, values, fmt, args.preset,
+                      args.memory * 2 ** 20, state, args.settle)
+    signal.signal(signal.SIGINT, watcher.stop)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    print(f'Watching {args.folder} (Ctrl+C to stop)')
+    last_report = time.monotonic()
+    pool = ProcessPoolExecutor(jobs, initializer = init_worker)
+    try:
+        while not watcher.stopping or watcher.pending:
+            changed = False
+            if not watcher.stopping:
+                watcher.scan()
+                changed = watcher.submit(pool, max_in_flight)
+            if watcher.collect(args.interval) or changed:
+                state.save(watcher.report())
+            if time.monotonic() - last_report >= args.stats:
+                last_report = time.monotonic()
+                print(json.dumps(watcher.report()), flush = True)
+    except KeyboardInterrupt:
+        for future in watcher.pending:
+            future.cancel()
+        pool.shutdown(wait = False, cancel_futures = True)
+    else:
+        pool.shutdown()
+    state.save(watcher.report())
+    print(json.dumps(watcher.report()))
+    return 0
@@ -0,0 +1,5 @@
+"""
+Benchmarks of the image processing and display paths.
+Run them from the root of the repository, e.g.:
+    python -m benchmarks.qt_conversion
+"""
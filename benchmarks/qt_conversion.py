@@ -0,0 +1,167 @@
+"""
+Benchmark of the conversion of a rendered image to the pixmap
+displayed by Picture, comparing the current path (the tiles that
+changed are converted by Picture.changed_tiles and painted on the
+displayed image, which is then scaled) with the one it replaced.
+The current path is timed when all the tiles change (e.g., a new
+edit) and when only a few of them do.
+Every step is timed and the size of the buffer it allocates is
+reported, so the number of full-frame copies per update is visible.
+
+Usage:
+    python -m benchmarks.qt_conversion [--size 4000x3000] [--label 1280x720]
+"""
+
+import argparse
+import os
+import sys
+import time
+from functools import partial
+from types import SimpleNamespace
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PIL import Image
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import Qt
+
+from Modules.Gui.picture import Picture, \
+                               paint_tiles
+from Modules.Gui.pyramid import Pyramid
+
+# Tiles changed in the benchmark of a few tiles.
+FEW_TILES = 4
+
+def nbytes(obj, shared = False):
+    """
+    Size in bytes of the pixels held by 'obj', not counting the
+    QImages wrapping buffers held by 'obj' too if 'shared'.
+    """
+    if isinstance(obj, Image.Image):
+        return obj.width * obj.height * len(obj.getbands())
+    if isinstance(obj, QImage) and shared:
+        return 0
+    if isinstance(obj, (QImage, QPixmap)):
+        return obj.width() * obj.height() * obj.depth() // 8
+    if isinstance(obj, (tuple, list)):
+        return sum(nbytes(o, shared) for o in obj)
+    if isinstance(obj, bytes):
+        return len(obj)
+    return 0
+
+def timed(steps, name, function, *args, shares = False):
+    """
+    Call 'function(*args)' and append its name, duration and
+    allocated bytes to 'steps'. A QImage wrapping an existing
+    buffer ('shares') allocates nothing.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    size = nbytes(result, shares) if isinstance(result, (tuple, list)) else \
+           0 if shares else nbytes(result)
+    steps.append((name, elapsed, size))
+    return result
+
+def legacy_path(image, w, h):
+    """
+    Conversion used before: swap the bands with split and merge,
+    copy to bytes, build a full size pixmap and scale it.
+    """
+    steps = []
+    step = partial(timed, steps)
+    r, g, b, alpha = step('split', image.split)
+    bgra = step('merge', Image.merge, 'RGBA', (b, g, r, alpha))
+    data = step('tobytes', bgra.tobytes, 'raw', 'RGBA')
+    qim = step('QImage', QImage, data, image.width, image.height,
+               QImage.Format_ARGB32, shares = True)
+    pixmap = step('QPixmap.fromImage', QPixmap.fromImage, qim)
+    step('QPixmap.scaled', pixmap.scaled, w, h, Qt.KeepAspectRatio)
+    return steps
+
+def tile_state(image, changed = None):
+    """
+    Return the state Picture.changed_tiles works on, as after the
+    frames of the size of 'image' published so far: 'changed' of
+    the tiles of 'image' differ from them, or all if None.
+    """
+    state = SimpleNamespace(published = None, pipeline_generation = 0,
+                            hashes_key = None, tile_hashes = {},
+                            qim = QImage(image.width, image.height,
+                                         QImage.Format_RGBA8888))
+    if changed is not None:
+        paint_tiles(state.qim, Picture.changed_tiles(state, image))
+        for box in list(state.tile_hashes)[:changed]:
+            state.tile_hashes[box] = None
+    return state
+
+def current_path(image, w, h, state):
+    """
+    Conversion used by Picture.update, from the 'state' returned
+    by tile_state (which is not changed).
+    """
+    steps = []
+    step = partial(timed, steps)
+    state = SimpleNamespace(**vars(state))
+    state.published = None
+    state.tile_hashes = dict(state.tile_hashes)
+    tiles = step('Picture.changed_tiles', Picture.changed_tiles, state,
+                 image, shares = True)
+    step('paint_tiles', paint_tiles, state.qim, tiles)
+    pyramid = step('Pyramid', Pyramid, state.qim)
+    scaled = step('Pyramid.scaled', pyramid.scaled, w, h)
+    step('QPixmap.fromImage', QPixmap.fromImage, scaled)
+    return steps
+
+def measure(path, image, w, h, repeat):
+    """
+    Return the median time of each step of 'path' and the bytes
+    it allocates.
+    """
+    runs = [path(image, w, h) for _ in range(repeat)]
+    steps = []
+    for i, (name, _, size) in enumerate(runs[0]):
+        times = sorted(run[i][1] for run in runs)
+        steps.append((name, times[len(times) // 2], size))
+    return steps
+
+def report(title, steps, frame, out = sys.stdout):
+    total_time = sum(t for _, t, _ in steps)
+    total_bytes = sum(b for _, _, b in steps)
+    print(f'{title}', file = out)
+    for name, t, size in steps:
+        print(f'    {name:20s} {t * 1000:9.2f} ms {size / frame:6.2f} frames',
+              file = out)
+    print(f'    {"total":20s} {total_time * 1000:9.2f} ms '
+          f'{total_bytes / frame:6.2f} frames', file = out)
+    return total_time, total_bytes / frame
+
+def size_arg(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m benchmarks.qt_conversion')
+    parser.add_argument('--size', type = size_arg, default = (4000, 3000),
+        help = 'size of the rendered image (default 4000x3000)')
+    parser.add_argument('--label', type = size_arg, default = (1280, 720),
+        help = 'size of the label displaying it (default 1280x720)')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication([])
+    image = Image.linear_gradient('L').resize(args.size).convert('RGBA')
+    frame = args.size[0] * args.size[1] * 4
+    w, h = args.label
+    print(f'{args.size[0]}x{args.size[1]} RGBA image, {w}x{h} label')
+    old = report('before', measure(legacy_path, image, w, h, args.repeat), frame)
+    for title, changed in (('after, all tiles changed', None),
+                           (f'after, {FEW_TILES} tiles changed', FEW_TILES)):
+        path = partial(current_path, state = tile_state(image, changed))
+        new = report(title, measure(path, image, w, h, args.repeat), frame)
+        print(f'speed-up {old[0] / new[0]:.1f}x, '
+              f'copies {old[1]:.2f} -> {new[1]:.2f} frames')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+"""
+Benchmark suite of the functions in Modules/image_tools.py and of the
+conversion done by Picture to display a frame.
+
+Synthetic RGBA images of the given sizes (in megapixels) are generated
+and every function is timed on each of them. For each benchmark the
+median wall time, the peak resident memory and the number of images
+allocated by Pillow are reported, and the results can be written as
+json. A previous json file can be used as a baseline: 'compare' fails
+when a benchmark got slower than the baseline by more than a threshold.
+
+The start of the GUI is timed as well, from the launch of the
+interpreter to the first window, together with the modules that
+take longest to import.
+
+Usage:
+    python -m benchmarks.suite run [--sizes 1,8,24,100] [-o results.json]
+    python -m benchmarks.suite compare baseline.json results.json [--threshold 0.1]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import PIL
+from PIL import Image
+
+from Modules import edits
+from Modules import image_tools
+
+SIZES = (1, 8, 24, 100)
+# Longest acceptable time to the first window, in seconds.
+STARTUP_TARGET = 0.3
+# Slowest imports reported.
+SLOWEST_IMPORTS = 5
+
+# Kept alive for the display benchmarks.
+_app = None
+
+def synthetic_image(megapixels):
+    """
+    Deterministic 4:3 RGBA image with noise, gradients and a white
+    area (for make_transparent).
+    """
+    h = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    w = int(megapixels * 1e6 / h)
+    red = Image.effect_noise((w, h), 64)
+    green = Image.linear_gradient('L').resize((w, h))
+    blue = Image.radial_gradient('L').resize((w, h))
+    alpha = Image.new('L', (w, h), 255)
+    image = Image.merge('RGBA', (red, green, blue, alpha))
+    image.paste((255, 255, 255, 255), (0, 0, w // 4, h // 4))
+    return image
+
+def reset_peak_rss():
+    """
+    Reset the peak resident memory of the process (linux only).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss():
+    """
+    Peak resident memory of the process, in bytes.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+def measure(function, repeat):
+    """
+    Time 'function' and return its statistics.
+    """
+    times = []
+    stats = Image.core.get_stats()
+    reset_peak_rss()
+    tracemalloc.start()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = Image.core.get_stats()
+    return {'wall_s'             : statistics.median(times),
+            'min_s'              : min(times),
+            'peak_rss_bytes'     : peak_rss(),
+            'pil_images_per_run' : (after['new_count'] - stats['new_count']) / repeat,
+            'python_peak_bytes'  : python_peak}
+
+def image_tools_benchmarks(image, path):
+    """
+    Return (name, function) pairs for the functions in image_tools.
+    The bands offsets, brightness and contrast are applied with the
+    lookup table of image_tools.tone_table.
+    """
+    histogram = image_tools.get_histogram(image)
+    benchmarks = [
+        ('prepare_image', lambda: image_tools.prepare_image(path, None).load()),
+        ('tone_table[RGB offsets]', lambda: image_tools.apply_table(image,
+            image_tools.tone_table(histogram, red = 40, blue = -30))),
+        ('tone_table[RGB+Brightness+Contrast]', lambda: image_tools.apply_table(
+            image, image_tools.tone_table(histogram, red = 40, brightness = 1.2,
+                                          contrast = 1.5))),
+    ]
+    for effect in ('Color', 'Contrast', 'Brightness', 'Sharpness'):
+        benchmarks.append((f'change_effect[{effect}]',
+            lambda effect = effect: image_tools.change_effect(image, effect, 1.7)))
+    sharpness = image_tools.degenerate(image, 'Sharpness')
+    benchmarks.append(('enhance[Sharpness, cached degenerate]',
+        lambda: image_tools.enhance(image, sharpness, 1.7)))
+    for name in image_tools.FILTERS:
+        benchmarks.append((f'apply_filter[{name}]',
+            lambda name = name: image_tools.apply_filter(image, name)))
+    benchmarks.append(('apply_filters[SMOOTH+SHARPEN+EMBOSS]',
+        lambda: image_tools.apply_filters(image, ('SMOOTH', 'SHARPEN', 'EMBOSS'))))
+    benchmarks.append(('make_transparent',
+                       lambda: image_tools.make_transparent(image)))
+    values = {'red' : 20, 'Contrast' : 1.3, 'Color' : 1.2, 'Sharpness' : 1.5,
+              'filter' : 'SMOOTH', 'transparency' : True}
+    benchmarks.append(('Pipeline.render',
+        lambda: edits.Pipeline(image).render(edits.Edits(values))))
+    return benchmarks
+
+def display_benchmarks(image):
+    """
+    Return the benchmarks of the conversion of a frame for Qt, done
+    offscreen, when all its tiles changed and when a few did.
+    Empty if PyQt5 is not available.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError:
+        return []
+    from .qt_conversion import current_path, \
+                               tile_state,   \
+                               FEW_TILES
+    global _app
+    _app = QApplication.instance() or QApplication([])
+    every = tile_state(image)
+    few = tile_state(image, FEW_TILES)
+    return [('Picture.update[all tiles changed]',
+             lambda: current_path(image, 1280, 720, every)),
+            (f'Picture.update[{FEW_TILES} tiles changed]',
+             lambda: current_path(image, 1280, 720, few))]
+
+def slowest_imports(report):
+    """
+    Return the top level modules that take longest to import, as
+    (name, seconds), from the output of 'python -X importtime'.
+    """
+    imports = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Modules imported by other modules are indented.
+        if not name.startswith('  '):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    imports.sort(key = lambda i: i[1], reverse = True)
+    return imports[:SLOWEST_IMPORTS]
+
+def startup_benchmark(repeat):
+    """
+    Start the GUI offscreen 'repeat' times in a new interpreter
+    and time it up to the first window (see pycture.py
+    --startup-report). Return None if PyQt5 is not available.
+    """
+    script = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'pycture.py')
+    env = dict(os.environ, QT_QPA_PLATFORM = 'offscreen')
+    command = [sys.executable, '-X', 'importtime', script, '--startup-report']
+    times = []
+    imports = []
+    for _ in range(repeat):
+        start = time.time()
+        process = subprocess.run(command, env = env, capture_output = True,
+                                 text = True)
+        if process.returncode or not process.stdout.strip():
+            return None
+        report = json.loads(process.stdout.splitlines()[-1])
+        times.append(report['time'] - start)
+        imports = slowest_imports(process.stderr)
+    return {'name'               : 'startup[first window]',
+            'megapixels'         : 0,
+            'wall_s'             : statistics.median(times),
+            'min_s'              : min(times),
+            'peak_rss_bytes'     : 0,
+            'pil_images_per_run' : 0,
+            'python_peak_bytes'  : 0,
+            'imports'            : imports}
+
+def run(sizes, repeat, out = sys.stdout):
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for megapixels in sizes:
+            image = synthetic_image(megapixels)
+            path = os.path.join(folder, 'image.png')
+            image.save(path, compress_level = 1)
+            benchmarks = (image_tools_benchmarks(image, path)
+                          + display_benchmarks(image))
+            for name, function in benchmarks:
+                result = {'name' : name, 'megapixels' : megapixels}
+                result.update(measure(function, repeat))
+                results.append(result)
+                print(f'{megapixels:4}MP {name:40s} {result["wall_s"] * 1000:10.1f} ms '
+                      f'{result["peak_rss_bytes"] / 2 ** 20:8.0f} MB RSS '
+                      f'{result["pil_images_per_run"]:5.1f} images',
+                      file = out)
+                out.flush()
+            del image
+    result = startup_benchmark(repeat)
+    if result is not None:
+        results.append(result)
+        target = '' if result['wall_s'] <= STARTUP_TARGET else \
+                 f'  OVER TARGET ({STARTUP_TARGET * 1000:.0f} ms)'
+        print(f'     {result["name"]:40s} {result["wall_s"] * 1000:10.1f} ms{target}',
+              file = out)
+        for name, seconds in result['imports']:
+            print(f'       import {name:33s} {seconds * 1000:10.1f} ms', file = out)
+    return {'meta' : {'date'      : datetime.datetime.now().isoformat(),
+                      'python'    : platform.python_version(),
+                      'pillow'    : PIL.__version__,
+                      'platform'  : platform.platform(),
+                      'cpu_count' : os.cpu_count(),
+                      'repeat'    : repeat},
+            'results' : results}
+
+def compare(baseline, current, threshold, out = sys.stdout):
+    """
+    Print the change of wall time of every benchmark present in both
+    files. Return the number of benchmarks slower than the baseline
+    by more than 'threshold' (e.g., 0.1 for 10%).
+    """
+    key = lambda r: (r['name'], r['megapixels'])
+    old = {key(r) : r for r in baseline['results']}
+    regressions = 0
+    for result in current['results']:
+        base = old.get(key(result))
+        if base is None:
+            continue
+        ratio = result['wall_s'] / base['wall_s'] if base['wall_s'] else 1
+        regressed = ratio > 1 + threshold
+        regressions += regressed
+        print(f'{result["megapixels"]:4}MP {result["name"]:40s} '
+              f'{base["wall_s"] * 1000:10.1f} -> {result["wall_s"] * 1000:10.1f} ms '
+              f'{(ratio - 1) * 100:+7.1f}%{"  REGRESSION" if regressed else ""}',
+              file = out)
+    print(f'{regressions} regressions (threshold {threshold * 100:.0f}%)', file = out)
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = 'python -m benchmarks.suite')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    run_parser = commands.add_parser('run', help = 'run the benchmarks')
+    run_parser.add_argument('--sizes', default = ','.join(map(str, SIZES)),
+        help = 'comma separated image sizes in megapixels')
+    run_parser.add_argument('--repeat', type = int, default = 3)
+    run_parser.add_argument('-o', '--output', help = 'json file for the results')
+    compare_parser = commands.add_parser('compare',
+        help = 'compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type = float, default = 0.1,
+        help = 'allowed slow down, as a fraction (default 0.1)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(',')]
+        results = run(sizes, args.repeat)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent = 2)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    return 1 if compare(baseline, current, args.threshold) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,77 @@
 """
 Run this script to start the application.
+Run 'python pycture.py --startup-report' to print how long the start
+takes and exit.
+Run 'python pycture.py batch --help' to edit images without the GUI,
+or 'python pycture.py watch --help' to edit the images written into a folder.
+Run 'python pycture.py cache info' (or 'clear') to inspect the cache of
+the decoded images.
 """
 
+import time
+
+START = time.perf_counter()
+
+import importlib.util
 import sys
-from PyQt5.QtWidgets import QApplication
-from Modules.Gui.main_window import MainWindow
 
-if __name__ == '__main__':
+# Modules not needed to display the first window: they are
+# loaded the first time they are used, i.e., when an image is opened.
+LAZY_MODULES = ('PIL.Image', 'PIL.ImageChops', 'PIL.ImageEnhance',
+                'PIL.ImageFilter')
+
+def lazy_import(name):
+    """
+    Import the module 'name' without executing it until one of
+    its attributes is used.
+    """
+    if name in sys.modules:
+        return
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    setattr(sys.modules[parent], child, module)
+
+def startup_report(app, imported):
+    """
+    Print the time taken to import the modules and to display the
+    first window, as json, and quit.
+    """
+    import json
+
+    app.processEvents()
+    print(json.dumps({'imports_s'      : round(imported - START, 4),
+                      'first_window_s' : round(time.perf_counter() - START, 4),
+                      'time'           : time.time()}), flush = True)
+    app.quit()
+
+def start_gui(report = False):
+    for name in LAZY_MODULES:
+        lazy_import(name)
+    from functools import partial
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    from Modules.Gui.main_window import MainWindow
+    imported = time.perf_counter()
+
     app = QApplication(sys.argv)
     main = MainWindow()
-    sys.exit(app.exec_())
+    if report:
+        QTimer.singleShot(0, partial(startup_report, app, imported))
+    return app.exec_()
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from Modules import batch
+        sys.exit(batch.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'watch':
+        from Modules import watch
+        sys.exit(watch.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'cache':
+        from Modules import decode_cache
+        sys.exit(decode_cache.main(sys.argv[2:]))
+    sys.exit(start_gui(report = '--startup-report' in sys.argv))
@@ -0,0 +1,30 @@
+"""
+Two images must never be saved as the same file.
+"""
+
+import os
+import unittest
+
+from Modules import batch
+
+class TestOutputNames(unittest.TestCase):
+    def test_unique(self):
+        paths = ['scans/a.png', 'scans/b.png', 'more/c.jpg']
+        self.assertEqual(batch.output_names(paths, 'out', None),
+                         {'scans/a.png' : os.path.join('out', 'a.png'),
+                          'scans/b.png' : os.path.join('out', 'b.png'),
+                          'more/c.jpg'  : os.path.join('out', 'c.jpg')})
+
+    def test_same_name(self):
+        with self.assertRaises(ValueError) as raised:
+            batch.output_names(['scans/a.png', 'more/a.png'], 'out', None)
+        self.assertIn('scans/a.png, more/a.png', str(raised.exception))
+
+    def test_same_format(self):
+        paths = ['scans/a.png', 'scans/a.jpg']
+        self.assertEqual(len(batch.output_names(paths, 'out', None)), 2)
+        with self.assertRaises(ValueError):
+            batch.output_names(paths, 'out', 'png')
+
+if __name__ == '__main__':
+    unittest.main()
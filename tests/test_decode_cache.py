@@ -0,0 +1,100 @@
+"""
+The entries of the decode cache must give back the pixels stored,
+and only for the file they were stored for.
+"""
+
+import errno
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from Modules import decode_cache
+
+SIZE = (300, 230)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        environment = {'PYCTURE_CACHE' : os.path.join(self.directory.name,
+                                                      'cache')}
+        patcher = mock.patch.dict(os.environ, environment)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = os.path.join(self.directory.name, 'image.png')
+        self.image = Image.effect_noise(SIZE, 40).convert('RGBA')
+        self.image.save(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.assertIsNone(decode_cache.load(self.path))
+        # More rows than are written at a time.
+        with mock.patch.object(decode_cache, 'WRITE_ROWS', 64):
+            decode_cache.store(self.path, self.image)
+        loaded = decode_cache.load(self.path)
+        self.assertEqual(loaded.mode, 'RGBA')
+        self.assertEqual(loaded.size, SIZE)
+        self.assertEqual(loaded.tobytes(), self.image.tobytes())
+        entry = decode_cache.entry_path(self.path)
+        self.assertEqual(os.path.getsize(entry),
+                         decode_cache.HEADER.size + 4 * SIZE[0] * SIZE[1])
+
+    def test_changed_file(self):
+        decode_cache.store(self.path, self.image)
+        Image.new('RGBA', SIZE, 'blue').save(self.path)
+        self.assertIsNone(decode_cache.load(self.path))
+
+    def test_entry_computed_before(self):
+        entry = decode_cache.entry_path(self.path)
+        Image.new('RGBA', SIZE, 'blue').save(self.path)
+        decode_cache.store(self.path, self.image, entry)
+        # Stored for the old file only.
+        self.assertIsNone(decode_cache.load(self.path))
+        self.assertEqual(decode_cache.load(self.path, entry).tobytes(),
+                         self.image.tobytes())
+
+    def test_truncated_entry(self):
+        decode_cache.store(self.path, self.image)
+        entry = decode_cache.entry_path(self.path)
+        with open(entry, 'r+b') as f:
+            f.truncate(os.path.getsize(entry) - 1)
+        self.assertIsNone(decode_cache.load(self.path))
+
+    def test_failed_write(self):
+        full = OSError(errno.ENOSPC, 'No space left on device')
+        with mock.patch.object(decode_cache.image_tools, 'rows_data',
+                               side_effect = full):
+            decode_cache.store(self.path, self.image)
+        self.assertEqual(os.listdir(decode_cache.cache_dir()), [])
+        self.assertIsNone(decode_cache.load(self.path))
+
+    def test_stale_temporary(self):
+        decode_cache.store(self.path, self.image)
+        temporary = decode_cache.entry_path(self.path) + '.1.1.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(b'partial')
+        decode_cache.trim()
+        # Maybe still being written.
+        self.assertTrue(os.path.exists(temporary))
+        self.assertEqual(decode_cache.clear(), 1)
+        self.assertEqual(os.listdir(decode_cache.cache_dir()), [])
+
+    def test_read_only(self):
+        decode_cache.store(self.path, self.image)
+        with mock.patch.object(decode_cache.os, 'utime',
+                               side_effect = PermissionError):
+            loaded = decode_cache.load(self.path)
+        self.assertEqual(loaded.tobytes(), self.image.tobytes())
+
+    def test_trim(self):
+        decode_cache.store(self.path, self.image)
+        self.assertEqual(len(decode_cache.entries()), 1)
+        decode_cache.trim(0)
+        self.assertEqual(decode_cache.entries(), [])
+
+if __name__ == '__main__':
+    unittest.main()
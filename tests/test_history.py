@@ -0,0 +1,105 @@
+"""
+The history must give back the exact images and parameters, merge
+only the changes of one gesture and stay within its memory budget.
+"""
+
+import unittest
+
+from PIL import Image
+
+from Modules import history
+
+SIZE = (600, 430)
+
+class TestSourceStep(unittest.TestCase):
+    def test_round_trip(self):
+        old = Image.effect_noise(SIZE, 40).convert('RGBA')
+        new = old.copy()
+        # Changes a few tiles, one of them only partially.
+        new.paste((255, 0, 0, 128), (100, 100, 300, 140))
+        step = history.SourceStep({'red' : 10})
+        step.record(old, new)
+        self.assertEqual(len(step.tiles), 2)
+        self.assertEqual(step.undo(new).tobytes(), old.tobytes())
+        self.assertEqual(step.redo(old).tobytes(), new.tobytes())
+        # The images given are not changed.
+        self.assertNotEqual(old.tobytes(), new.tobytes())
+
+    def test_unchanged(self):
+        image = Image.effect_noise(SIZE, 40).convert('RGBA')
+        step = history.SourceStep({})
+        step.record(image, image.copy())
+        self.assertEqual(step.tiles, [])
+        self.assertEqual(step.nbytes, history.PARAMS_BYTES)
+
+class TestHistory(unittest.TestCase):
+    def test_no_change(self):
+        h = history.History()
+        h.record_edit('red', 10, 10)
+        self.assertEqual(h.undo_steps, [])
+
+    def test_toggles(self):
+        h = history.History()
+        h.record_edit('transparency', False, True)
+        h.record_edit('transparency', True, False)
+        self.assertEqual(len(h.undo_steps), 2)
+
+    def test_group(self):
+        h = history.History()
+        h.start_group()
+        for value in range(10, 60, 10):
+            h.record_edit('red', value - 10, value)
+        h.end_group()
+        h.start_group()
+        h.record_edit('red', 50, 60)
+        h.end_group()
+        self.assertEqual([(s.before, s.after) for s in h.undo_steps],
+                         [({'red' : 0}, {'red' : 50}),
+                          ({'red' : 50}, {'red' : 60})])
+
+    def test_group_back_to_start(self):
+        h = history.History()
+        h.record_edit('blue', 0, 5)
+        with h.group():
+            h.record_edit('red', 0, 20)
+            h.record_edit('green', 0, 20)
+            h.record_edit('red', 20, 0)
+        self.assertEqual(h.undo_steps[-1].after, {'green' : 20})
+        with h.group():
+            h.record_edit('red', 0, 20)
+            h.record_edit('red', 20, 0)
+        self.assertEqual(len(h.undo_steps), 2)
+        # Nothing was redone: the previous steps are kept.
+        self.assertEqual(h.undo_steps[0].after, {'blue' : 5})
+
+    def test_eviction(self):
+        h = history.History(max_bytes = 3 * history.PARAMS_BYTES)
+        for value in range(1, 6):
+            h.record_edit('red', value - 1, value)
+        self.assertEqual([s.after['red'] for s in h.undo_steps], [3, 4, 5])
+
+    def test_eviction_after_record(self):
+        h = history.History(max_bytes = 10 * history.PARAMS_BYTES)
+        for value in range(1, 4):
+            h.record_edit('red', value - 1, value)
+        step = history.SourceStep({})
+        h.push(step)
+        self.assertEqual(len(h.undo_steps), 4)
+        old = Image.effect_noise(SIZE, 40).convert('RGBA')
+        step.record(old, Image.effect_noise(SIZE, 40).convert('RGBA'))
+        h.trim()
+        # The oldest steps go first; the last one is always kept.
+        self.assertEqual(h.undo_steps, [step])
+
+    def test_undo_redo(self):
+        h = history.History()
+        h.record_edit('red', 0, 1)
+        h.record_edit('red', 1, 2)
+        self.assertEqual(h.undo().after, {'red' : 2})
+        self.assertEqual(h.redo().after, {'red' : 2})
+        h.undo()
+        h.record_edit('blue', 0, 1)
+        self.assertIsNone(h.redo())
+
+if __name__ == '__main__':
+    unittest.main()
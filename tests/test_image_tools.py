@@ -0,0 +1,74 @@
+"""
+The operations processed in tiles must give the same pixels as
+the same operations applied to the whole image in a single pass.
+"""
+
+import unittest
+from unittest import mock
+
+from PIL import Image, \
+                ImageEnhance, \
+                ImageFilter
+
+from Modules import image_tools
+
+# Several tiles of image_tools.TILE_SIZE, the last ones partial.
+SIZE = (1100, 700)
+STACKS = (('SMOOTH', 'SHARPEN', 'EMBOSS'),
+          ('EDGE_ENHANCE_MORE', 'BLUR', 'FIND_EDGES', 'DETAIL'))
+
+def sample_image():
+    noise = Image.effect_noise(SIZE, 60)
+    gradient = Image.linear_gradient('L').resize(SIZE)
+    alpha = Image.radial_gradient('L').resize(SIZE)
+    return Image.merge('RGBA', (noise, gradient,
+                                noise.transpose(Image.Transpose.ROTATE_180),
+                                alpha))
+
+def single_pass(image, names):
+    result = image.convert('RGB')
+    for name in names:
+        result = result.filter(getattr(ImageFilter, name))
+    result.putalpha(image.getchannel('A'))
+    return result
+
+class TestTiles(unittest.TestCase):
+    def setUp(self):
+        self.image = sample_image()
+        # Tiled whatever the size of the image and the cores here.
+        for patcher in (mock.patch.object(image_tools, 'TILED_MIN_PIXELS', 0),
+                        mock.patch.object(image_tools.os, 'cpu_count',
+                                          return_value = 4)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_tiled(self):
+        with mock.patch.object(image_tools, 'get_pool',
+                               wraps = image_tools.get_pool) as get_pool:
+            image_tools.apply_filter(self.image, 'BLUR')
+        get_pool.assert_called()
+
+    def test_filters(self):
+        for name in image_tools.FILTERS:
+            with self.subTest(name = name):
+                self.assertEqual(
+                    image_tools.apply_filter(self.image, name).tobytes(),
+                    single_pass(self.image, (name,)).tobytes())
+
+    def test_stacks(self):
+        for names in STACKS:
+            with self.subTest(names = names):
+                self.assertEqual(
+                    image_tools.apply_filters(self.image, names).tobytes(),
+                    single_pass(self.image, names).tobytes())
+
+    def test_degenerate(self):
+        for effect in ('Color', 'Sharpness'):
+            with self.subTest(effect = effect):
+                expected = getattr(ImageEnhance, effect)(self.image)
+                self.assertEqual(
+                    image_tools.degenerate(self.image, effect).tobytes(),
+                    expected.degenerate.tobytes())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+Superseded jobs of the scheduler must never run.
+"""
+
+import threading
+import unittest
+
+from Modules.scheduler import RenderScheduler
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RenderScheduler()
+        self.ran = []
+        # Keeps the scheduler busy while the jobs are queued.
+        self.release = threading.Event()
+        self.scheduler.submit(self.release.wait)
+
+    def run_jobs(self):
+        self.release.set()
+        self.assertTrue(self.scheduler.wait(5))
+
+    def test_order(self):
+        for name in ('a', 'b', 'c'):
+            self.scheduler.submit(self.ran.append, name)
+        self.run_jobs()
+        self.assertEqual(self.ran, ['a', 'b', 'c'])
+
+    def test_replaced(self):
+        submit = self.scheduler.submit
+        submit(self.ran.append, 'render 1', key = 'render')
+        submit(self.ran.append, 'view 1', key = 'view')
+        submit(self.ran.append, 'preview')
+        submit(self.ran.append, 'render 2', key = 'render')
+        submit(self.ran.append, 'view 2', key = 'view')
+        self.run_jobs()
+        self.assertEqual(self.ran, ['preview', 'render 2', 'view 2'])
+
+    def test_cancel(self):
+        self.scheduler.submit(self.ran.append, 'render', key = 'render')
+        self.scheduler.cancel()
+        self.run_jobs()
+        self.assertEqual(self.ran, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""
+The out-of-core processing of TIFF images must give the same pixels
+as the edits rendered on the whole image in memory.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from Modules import edits
+from Modules import image_tools
+from Modules import tiled
+
+SIZE = (300, 230)
+TILE_SIZE = 64
+# Small enough to process the image in several bands.
+BUDGET = 1
+VALUES = {'red' : 20, 'Contrast' : 1.3, 'Sharpness' : 1.8,
+          'filter' : ('SMOOTH', 'SHARPEN')}
+
+def sample_image():
+    """
+    Noise with a gradient, so that every band and tile differ.
+    """
+    noise = Image.effect_noise(SIZE, 40)
+    gradient = Image.linear_gradient('L').resize(SIZE)
+    return Image.merge('RGB', (noise, gradient, noise.transpose(
+        Image.Transpose.FLIP_LEFT_RIGHT)))
+
+class TestProcess(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.image = sample_image()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def check(self, path, streamed = True):
+        """
+        Process the TIFF at 'path' in bands and compare the output
+        with the edits rendered in memory.
+        """
+        edits_ = edits.Edits(VALUES)
+        output = self.path('output.tif')
+        self.assertEqual(tiled.process(path, output, edits_, BUDGET,
+                                       tile_size = TILE_SIZE), streamed)
+        expected = edits.Pipeline(image_tools.prepare_image(path, None))
+        expected = expected.render(edits_).convert('RGB')
+        with Image.open(output) as result:
+            self.assertEqual(result.size, SIZE)
+            self.assertEqual((result.tag_v2[tiled.TILE_WIDTH],
+                              result.tag_v2[tiled.TILE_LENGTH]),
+                             (TILE_SIZE, TILE_SIZE))
+            self.assertEqual(result.convert('RGB').tobytes(),
+                             expected.tobytes())
+
+    def test_strips(self):
+        for compression in ('raw', 'tiff_lzw', 'tiff_deflate', 'jpeg',
+                            'packbits'):
+            with self.subTest(compression = compression):
+                path = self.path(f'{compression}.tif')
+                # Several strips, not aligned with the bands.
+                self.image.save(path, compression = compression,
+                                strip_size = 50 * SIZE[0] * 3)
+                self.check(path)
+
+    def test_single_strip(self):
+        path = self.path('single.tif')
+        self.image.save(path, compression = 'tiff_lzw',
+                        strip_size = SIZE[0] * SIZE[1] * 3)
+        with mock.patch.object(image_tools, 'prepare_image',
+                               wraps = image_tools.prepare_image) as prepare, \
+             mock.patch.object(image_tools, 'decode_tiff',
+                               wraps = image_tools.decode_tiff) as decode:
+            self.check(path, streamed = False)
+        # Once by the reader, once for the expected image.
+        self.assertEqual(prepare.call_count, 2)
+        self.assertEqual(decode.call_count, 0)
+
+    def test_tall_strips(self):
+        path = self.path('tall.tif')
+        # Two strips, each taller than a band.
+        self.image.save(path, compression = 'tiff_lzw',
+                        strip_size = 150 * SIZE[0] * 3)
+        with mock.patch.object(image_tools, 'decode_tiff',
+                               wraps = image_tools.decode_tiff) as decode:
+            self.check(path)
+        # The first strip, both strips (for the band across them)
+        # and the second strip, for the histogram and for the render.
+        self.assertLessEqual(decode.call_count, 6)
+
+    def test_rgba(self):
+        path = self.path('rgba.tif')
+        image = self.image.copy()
+        image.putalpha(Image.linear_gradient('L').resize(SIZE))
+        image.save(path, compression = 'tiff_lzw')
+        self.check(path)
+
+    def test_tiles(self):
+        for level in (None, 6):
+            with self.subTest(level = level):
+                path = self.path(f'tiled-{level}.tif')
+                with tiled.TiffWriter(path, SIZE, 32, level) as writer:
+                    for y in range(0, SIZE[1], 32):
+                        writer.write(self.image.crop((0, y, SIZE[0], y + 32)))
+                self.check(path)
+
+    def test_writer(self):
+        for level in (None, 6):
+            with self.subTest(level = level):
+                path = self.path(f'written-{level}.tif')
+                with tiled.TiffWriter(path, SIZE, TILE_SIZE, level) as writer:
+                    for y in range(0, SIZE[1], TILE_SIZE):
+                        writer.write(self.image.crop(
+                            (0, y, SIZE[0], min(SIZE[1], y + TILE_SIZE))))
+                with Image.open(path) as written:
+                    self.assertEqual(written.convert('RGB').tobytes(),
+                                     self.image.tobytes())
+
+if __name__ == '__main__':
+    unittest.main()